@@ -1,3 +1,11 @@
 # Nothing
-import dataproc.processor
-import dataproc.papp
\ No newline at end of file
+# processor and papp (and so configargparse, appdirs) are only imported when first used,
+# so the filesystem modules (scan, globcache, snapshot, parallel, ...) that obs_deptree
+# uses can be imported with the stdlib alone.
+import importlib
+
+
+def __getattr__(name):
+    if name in ('processor', 'papp'):
+        return importlib.import_module('dataproc.' + name)
+    raise AttributeError("module 'dataproc' has no attribute %r" % name)
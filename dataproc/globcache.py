@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
+# Cache of directory glob results.
+#
+# Adding, removing or renaming an entry updates its directory's mtime, so the names in a
+# directory that match a pattern stay valid for as long as the directory's mtime doesn't
+# change.  Each lookup then costs one stat of the directory instead of a listing.
+#
+# Keyed by (directory, pattern); bounded, evicting the least recently used.
+# A listing taken within racy_ns of the directory's mtime isn't trusted: a second change
+# in the same timestamp tick wouldn't move the mtime.
+
+_default_cache = None
+
+
+def get_globcache():
+    # The cache shared by scan_pathglob and the deptree glob nodes
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = GlobCache()
+    return _default_cache
+
+
+class GlobCache:
+    def __init__(self, maxsize=4096, racy_ns=1000000000):
+        self.maxsize = maxsize
+        self.racy_ns = racy_ns
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (dir, pattern) -> (dir mtime_ns, [(name, is_dir)])
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def match(self, d, pattern):
+        # [(name, is_dir)] for the entries of directory d matching pattern
+        try:
+            mtime = os.stat(d).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return []
+
+        key = (d, pattern)
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None and hit[0] == mtime:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return hit[1]
+            self.misses += 1
+
+        listed = time.time_ns()
+        matched = [(name, isdir) for name, isdir in listdir(d) if fnmatchcase(name, pattern)]
+        if listed - mtime < self.racy_ns or self.maxsize <= 0:
+            return matched
+
+        with self._lock:
+            self._entries[key] = (mtime, matched)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return matched
+
+
+def listdir(d):
+    # [(name, is_dir)], or [] if d isn't a readable directory
+    try:
+        with os.scandir(d) as it:
+            return [(e.name, _is_dir(e)) for e in it]
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return []
+
+
+def _is_dir(entry):
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
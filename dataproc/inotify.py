@@ -0,0 +1,118 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+
+# Minimal Linux inotify, through ctypes: no extension module, no external service.
+#
+#   ino = Inotify()
+#   wd = ino.add_watch('/some/dir')
+#   for wd, mask, name in ino.read(timeout=1.0):
+#       ...
+#
+# Watches are per directory and not recursive: the caller adds one for each directory
+# it cares about, including new ones as they are created (IN_CREATE | IN_ISDIR).
+# IN_Q_OVERFLOW (wd -1) means events were dropped: the caller has to rescan.
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Anything that can change an mtime, or a directory's set of entries
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len; then len bytes of name
+
+_libc = None
+
+
+def available():
+    try:
+        _get_libc()
+        return True
+    except OSError:
+        return False
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is Linux only')
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'no inotify in libc')
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+    return _libc
+
+
+def _check(rc):
+    if rc < 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return rc
+
+
+class Inotify:
+    def __init__(self):
+        self.fd = _check(_get_libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask=WATCH_MASK | IN_ONLYDIR):
+        # The watch descriptor; adding the same directory twice returns the same one
+        return _check(_get_libc().inotify_add_watch(self.fd, os.fsencode(path), mask))
+
+    def rm_watch(self, wd):
+        _get_libc().inotify_rm_watch(self.fd, wd)  # fails if the kernel dropped it: fine
+
+    def read(self, timeout=None):
+        # [(wd, mask, name str)] of the events pending, waiting up to timeout seconds
+        # (None: until there is one) if there are none yet
+        r, w, x = select.select([self.fd], [], [], timeout)
+        if not r:
+            return []
+        try:
+            buf = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        i = 0
+        while i + _EVENT.size <= len(buf):
+            wd, mask, cookie, length = _EVENT.unpack_from(buf, i)
+            i += _EVENT.size
+            name = buf[i:i + length].rstrip(b'\0')
+            i += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
@@ -0,0 +1,189 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+# Adaptive per-device I/O concurrency.
+#
+# One fixed concurrency is wrong when a basedir spans several devices: it thrashes a
+# spinning disk and underuses NFS or an SSD.  IOScheduler groups calls by the st_dev of
+# the path they touch, and gives each device its own limit, adjusted AIMD-style from
+# the latencies it measures:
+#   - every round (as many completions as the current limit), if the device's smoothed
+#     latency is still near its baseline (the best it has shown lately), the limit goes
+#     up by one;
+#   - if it has grown to backoff times that, requests are queueing at the device: the
+#     limit is halved.
+# Latencies under floor seconds (a cached stat) never count as congestion.
+#
+#   sched = IOScheduler(max_limit=32)
+#   sched.run(path, os.stat, path)      # blocks while path's device is at its limit
+#   sched.submit(pool, path, os.stat, path)   # a Future; queued while it's at its limit
+#   sched.limits()                      # {st_dev: current limit}
+#
+# submit() queues work per device and hands an item to the pool only once its device
+# has a free slot, so no worker ever waits on a throttled device while another device's
+# items could use it.  parallel.py routes the pool's work through it when
+# set_io_concurrency(n, adaptive=True).
+
+
+class DeviceLimiter:
+    def __init__(self, dev, max_limit=64, min_limit=1, start=4, backoff=2.0, floor=50e-6, alpha=0.2,
+                 drift=0.05):
+        self.dev = dev
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max(min_limit, min(start, max_limit)))
+        self.backoff = backoff
+        self.floor = floor
+        self.alpha = alpha
+        self.drift = drift
+        self.inflight = 0
+        self.completed = 0
+        self.queue = deque()    # (fn, args, Future) submitted, waiting for a slot
+        self.latency = None     # smoothed seconds per call
+        self.best = None        # baseline: the lowest smoothed latency, drifting up
+        self.throughput = None  # calls per second, over the last round
+        self._round = 0
+        self._round_start = time.perf_counter()
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                self._cond.wait()
+            self.inflight += 1
+
+    def try_acquire(self):
+        # acquire(), unless that would have to wait
+        with self._cond:
+            if self.inflight >= int(self.limit):
+                return False
+            self.inflight += 1
+            return True
+
+    def release(self, secs=None):
+        # secs=None: the slot wasn't used (a cancelled call), so nothing is measured
+        with self._cond:
+            self.inflight -= 1
+            if secs is None:
+                self._cond.notify_all()
+                return
+            self.completed += 1
+            if self.latency is None:
+                self.latency = secs
+            else:
+                self.latency += self.alpha * (secs - self.latency)
+            if self.best is None or self.latency < self.best:
+                self.best = self.latency
+
+            self._round += 1
+            if self._round >= int(self.limit):
+                now = time.perf_counter()
+                if now > self._round_start:
+                    self.throughput = self._round / (now - self._round_start)
+                self._round, self._round_start = 0, now
+                self._adjust()
+            self._cond.notify_all()
+
+    def _adjust(self):
+        if self.latency > max(self.best * self.backoff, self.floor):
+            self.limit = max(self.min_limit, self.limit / 2)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1)
+        # The baseline drifts towards the current latency every round, so a fast phase
+        # (cache hits) doesn't make the device's normal latency look like congestion forever
+        self.best += self.drift * (self.latency - self.best)
+
+    def stats(self):
+        return {'limit': int(self.limit), 'inflight': self.inflight, 'completed': self.completed,
+                'queued': len(self.queue), 'latency': self.latency, 'throughput': self.throughput}
+
+
+class IOScheduler:
+    def __init__(self, max_limit=64, **limiter_args):
+        self.max_limit = max_limit
+        self.limiter_args = limiter_args
+        self.devices = {}  # st_dev -> DeviceLimiter
+        self._devs = {}    # directory -> st_dev
+        self._lock = threading.Lock()
+
+    def device_of(self, path):
+        # st_dev of path's directory (the nearest one that exists), cached per directory
+        d = os.path.dirname(os.path.abspath(path))
+        dev = self._devs.get(d)
+        if dev is None:
+            probe = d
+            while True:
+                try:
+                    dev = os.stat(probe).st_dev
+                    break
+                except OSError:
+                    parent = os.path.dirname(probe)
+                    if parent == probe:
+                        dev = -1
+                        break
+                    probe = parent
+            self._devs[d] = dev
+        return dev
+
+    def limiter(self, path):
+        dev = self.device_of(path)
+        lim = self.devices.get(dev)
+        if lim is None:
+            with self._lock:
+                lim = self.devices.setdefault(
+                    dev, DeviceLimiter(dev, max_limit=self.max_limit, **self.limiter_args))
+        return lim
+
+    def run(self, path, fn, *args):
+        # fn(*args), once path's device is under its limit
+        lim = self.limiter(path)
+        lim.acquire()
+        t = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            lim.release(time.perf_counter() - t)
+
+    def submit(self, executor, path, fn, *args):
+        # A Future for fn(*args), run on executor once path's device is under its limit
+        lim = self.limiter(path)
+        f = Future()
+        with lim._cond:
+            lim.queue.append((fn, args, f))
+        self._dispatch(executor, lim)
+        return f
+
+    def _dispatch(self, executor, lim):
+        # Hand lim's queued items to executor for as long as it has free slots
+        while True:
+            with lim._cond:
+                if not lim.queue or not lim.try_acquire():
+                    return
+                fn, args, f = lim.queue.popleft()
+            executor.submit(self._run_queued, executor, lim, fn, args, f)
+
+    def _run_queued(self, executor, lim, fn, args, f):
+        if not f.set_running_or_notify_cancel():
+            lim.release()
+            self._dispatch(executor, lim)
+            return
+        t = time.perf_counter()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            lim.release(time.perf_counter() - t)
+            self._dispatch(executor, lim)
+            f.set_exception(e)
+        else:
+            lim.release(time.perf_counter() - t)
+            self._dispatch(executor, lim)
+            f.set_result(result)
+
+    def limits(self):
+        return {dev: int(lim.limit) for dev, lim in self.devices.items()}
+
+    def stats(self):
+        return {dev: lim.stats() for dev, lim in self.devices.items()}
@@ -0,0 +1,200 @@
+import os
+import re
+from fnmatch import translate
+from pathlib import Path
+
+from dataproc.globcache import get_globcache
+from dataproc.parallel import get_io_concurrency, io_map, io_submit, parallel
+from dataproc.scan import has_magic, split_pathglob, _matching, _stat_or_none, is_file
+from dataproc.snapshot import snapshot_for
+
+# Many pathglobs matched in one walk.
+#
+# compile_pathglobs(specs) builds a trie of path components shared by all the specs:
+# src/VID1/*.csv and src/VID2/*.csv share the src node, and every spec starting with
+# src/*/ shares the same compiled '*'.  match(basedir) then walks the tree once:
+#   - each directory reached by any spec is listed at most once, and every name in it is
+#     tested against all the patterns that apply there;
+#   - a literal component is looked up in that listing, or joined on if the directory
+#     needn't be listed at all;
+#   - each matched path is stat'ed once, however many specs it matches;
+#   - a '**' component matches zero or more directories, as in scan_pathglob;
+#   - with the I/O pool on (parallel.py), stats and listings run concurrently.
+# As in Pspec, a str spec is a pathglob and a Path spec is a single (regular) file.
+#
+#   m = compile_pathglobs(['src/VID1/*.csv', 'src/VID2/*.csv', Path('db/final')])
+#   for spec, found in m.match(basedir).items():
+#       found.files, found.min_mtime, found.max_mtime
+#   for spec, path, st in m.iter_matches(basedir):   # streamed, depth first
+#       ...
+
+
+class _Node:
+    __slots__ = ('literals', 'globs', 'star', 'recursive', 'specs')
+
+    def __init__(self, recursive=False):
+        self.literals = {}  # name -> _Node
+        self.globs = {}     # pattern -> (compiled, _Node)
+        self.star = None    # the _Node after a '**'
+        self.recursive = recursive  # reached through '**': applies in every subdirectory too
+        self.specs = []     # specs ending here
+
+    def child(self, part, literal):
+        if literal:
+            return self.literals.setdefault(part, _Node())
+        if part == '**':
+            if self.recursive:
+                return self  # a/**/**/b is a/**/b
+            if self.star is None:
+                self.star = _Node(recursive=True)
+            return self.star
+        if part not in self.globs:
+            self.globs[part] = (re.compile(translate(part)).match, _Node())
+        return self.globs[part][1]
+
+
+class SpecMatches:
+    # The matches of one spec
+    __slots__ = ('files', 'min_mtime', 'max_mtime')
+
+    def __init__(self):
+        self.files = []  # [(path str, os.stat_result)]
+        self.min_mtime = float('inf')
+        self.max_mtime = 0
+
+    @property
+    def filecount(self):
+        return len(self.files)
+
+    def add(self, p, st):
+        self.files.append((p, st))
+        mt = st.st_mtime_ns
+        if mt < self.min_mtime: self.min_mtime = mt
+        if mt > self.max_mtime: self.max_mtime = mt
+
+
+def compile_pathglobs(specs):
+    return PathglobMatcher(specs)
+
+
+class PathglobMatcher:
+    def __init__(self, specs):
+        self.specs = []
+        self._roots = {}  # '' (relative to basedir) or '/' -> _Node
+        for spec in specs:
+            self.add(spec)
+
+    def add(self, spec):
+        if spec in self.specs:
+            return
+        root, parts = split_pathglob(spec)
+        if not parts:
+            return
+        self.specs.append(spec)
+        node = self._roots.setdefault(root, _Node())
+        literal = isinstance(spec, Path)
+        for part in parts:
+            node = node.child(part, literal or not has_magic(part))
+        node.specs.append(spec)
+
+    def match(self, basedir=None, cache=True):
+        # {spec: SpecMatches} for every spec, from one walk.  cache as for scan_pathglob.
+        found = {spec: SpecMatches() for spec in self.specs}
+        for spec, p, st in self.iter_matches(basedir, cache):
+            found[spec].add(p, st)
+        return found
+
+    def iter_matches(self, basedir=None, cache=True):
+        # Yields (spec, path str, os.stat_result) for every match of every spec
+        for root, node in self._roots.items():
+            start = root or (str(basedir) if basedir is not None else os.curdir)
+            listfn, statfn = self._io(start, cache)
+            yield from self._walk(start, node, listfn, statfn)
+
+    def _io(self, start, cache):
+        if cache is True:
+            cache = snapshot_for(start) or get_globcache()
+        elif cache is False:
+            cache = None
+        statfn = cache.stat if hasattr(cache, 'stat') else _stat_or_none
+        # the whole listing, cached by the GlobCache or snapshot as pattern '*'
+        return (lambda d: _matching(d, '*', cache)), statfn
+
+    def _walk(self, start, node, listfn, statfn):
+        # Depth first; each entry is a directory and the trie nodes that reach it.
+        # Overlapping specs reach the same directory through several nodes: merged, so
+        # the directory is still listed once.  Only the pending directories are kept, and
+        # stats only for as long as their directory is being matched.
+        # With the I/O pool on (parallel.py), a directory's matches are stat'ed
+        # concurrently, and the listings of the directories below are started as soon as
+        # they're known.
+        work = [(start, [node])]
+        listings = {}  # directory -> Future of its listing
+        while work:
+            d, nodes = work.pop()
+            for n in nodes:  # '**' matching no directory: its node applies here as well
+                if n.star is not None and n.star not in nodes:
+                    nodes.append(n.star)
+            below = {}  # subdirectory -> [nodes]
+            matched = []  # (path, node)
+
+            def descend(p, child):
+                if child.literals or child.globs or child.star is not None:
+                    below.setdefault(p, [])
+                    if child not in below[p]:
+                        below[p].append(child)
+
+            for n in nodes:
+                if n.recursive and n.specs:
+                    matched.append((d, n))  # a spec ending in '**' matches directories
+
+            if any(n.globs or n.recursive for n in nodes):
+                entries = listings.pop(d).result() if d in listings else listfn(d)
+                names = dict(entries)
+                for name, isdir in entries:
+                    p = os.path.join(d, name)
+                    for n in nodes:
+                        for test, child in n.globs.values():
+                            if test(name):
+                                matched.append((p, child))
+                                if isdir:
+                                    descend(p, child)
+                        if n.recursive and isdir and not os.path.islink(p):
+                            descend(p, n)
+                for n in nodes:
+                    for name, child in n.literals.items():
+                        isdir = names.get(name)
+                        if isdir is None and name not in (os.curdir, os.pardir):
+                            continue  # not there; no stat needed
+                        p = os.path.join(d, name)
+                        matched.append((p, child))
+                        if isdir is not False:
+                            descend(p, child)
+            else:
+                # Nothing to list for: join literals on, stat'ing only where a spec ends
+                for n in nodes:
+                    for name, child in n.literals.items():
+                        p = os.path.join(d, name)
+                        matched.append((p, child))
+                        descend(p, child)
+
+            # Stat'ed as the matches are consumed (a chunk at a time with the pool on), so
+            # a caller that stops early hasn't paid for the rest of a big directory
+            matched = [(p, child) for p, child in matched if child.specs]
+            chunk = 4 * get_io_concurrency() if parallel() else 1
+            stats = {}
+            for i, (p, child) in enumerate(matched):
+                if p not in stats:
+                    want = list(dict.fromkeys(q for q, c in matched[i:i + chunk] if q not in stats))
+                    stats.update(zip(want, io_map(statfn, want)))
+                for spec in child.specs:
+                    st = stats[p]
+                    if st is None or (isinstance(spec, Path) and not is_file(st)):
+                        continue
+                    yield spec, p, st
+
+            if parallel():
+                for p, nodes in below.items():
+                    if any(n.globs or n.recursive or n.star is not None for n in nodes):
+                        listings[p] = io_submit(listfn, p)
+            work.extend(reversed(list(below.items())))
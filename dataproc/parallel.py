@@ -0,0 +1,155 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+from dataproc.iosched import IOScheduler
+from dataproc.snapshot import current_snapshots, open_snapshot, run_with, snapshot_for
+
+# Optional thread pool for filesystem I/O.
+#
+# On a high-latency mount (NFS) every stat and listing is a round trip; os.stat and
+# os.scandir release the GIL, so issuing them from several threads overlaps the round
+# trips and cuts wall-clock time roughly by the concurrency.
+#
+#   set_io_concurrency(16)          # or:  with io_concurrency(16): ...
+#
+# Off by default (concurrency 1): everything runs in the calling thread, in order.
+# When on, the pathglob matcher stats a directory's matches and lists the next
+# directories concurrently (so Pspec and GFDepTree glob nodes), and from_dict_tree stats
+# its nodes concurrently before creating them.
+#
+# adaptive=True: n is only the pool size; each device the calls touch gets its own limit,
+# adapted to its measured latency (see iosched.py).  io_run() puts a processor's own
+# reads and writes under the same limits.
+#
+# Work handed to the pool runs with the calling thread's open snapshots (snapshot.py).
+
+_concurrency = 1
+_pool = None
+_scheduler = None
+_lock = threading.Lock()
+
+
+def get_io_concurrency():
+    return _concurrency
+
+
+def get_io_scheduler():
+    # The IOScheduler in use, or None
+    return _scheduler
+
+
+def set_io_concurrency(n, adaptive=False):
+    # At most n filesystem calls in flight; 1 (or less) for none in parallel
+    global _concurrency, _pool, _scheduler
+    n = max(1, int(n))
+    with _lock:
+        if adaptive and n > 1:
+            if _scheduler is None or _scheduler.max_limit != n:
+                _scheduler = IOScheduler(max_limit=n)
+        else:
+            _scheduler = None
+        if n == _concurrency:
+            return
+        old, _pool = _pool, None
+        _concurrency = n
+    if old is not None:
+        old.shutdown(wait=True)
+
+
+@contextmanager
+def io_concurrency(n, adaptive=False):
+    saved = _concurrency, _scheduler
+    set_io_concurrency(n, adaptive)
+    try:
+        yield
+    finally:
+        _restore(*saved)
+
+
+def _restore(n, scheduler):
+    # Back to concurrency n, with the scheduler (and its learnt limits) as it was
+    global _scheduler
+    set_io_concurrency(n)
+    _scheduler = scheduler
+
+
+def parallel():
+    return _concurrency > 1
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=_concurrency, thread_name_prefix='io')
+        return _pool
+
+
+def io_run(path, fn, *args):
+    # fn(*args), here and now, within the limit of path's device when adaptive
+    sched = _scheduler
+    if sched is None:
+        return fn(*args)
+    return sched.run(path, fn, *args)
+
+
+def io_map(fn, items, key=None):
+    # [fn(item) for item in items], run across the pool when it's on.
+    # Each item is the path it touches, unless key(item) says otherwise.
+    items = list(items)
+    if not parallel() or len(items) < 2:
+        return [fn(item) for item in items]
+    fn = _with_snapshots(fn)
+    sched = _scheduler
+    if sched is not None:
+        # queued per device, so a throttled device doesn't hold up the workers
+        key = key or (lambda item: item)
+        pool = _get_pool()
+        futures = [sched.submit(pool, key(item), fn, item) for item in items]
+        return [f.result() for f in futures]
+    return list(_get_pool().map(fn, items))
+
+
+def io_submit(fn, path, *args):
+    # A Future for fn(path, *args): run on the pool when it's on, else right here
+    if parallel():
+        fn = _with_snapshots(fn)
+        sched = _scheduler
+        if sched is not None:
+            return sched.submit(_get_pool(), path, fn, path, *args)
+        return _get_pool().submit(fn, path, *args)
+    f = Future()
+    try:
+        f.set_result(fn(path, *args))
+    except BaseException as e:
+        f.set_exception(e)
+    return f
+
+
+def _with_snapshots(fn):
+    # fn, to run on a worker with this thread's open snapshots
+    snaps = current_snapshots()
+    return partial(run_with, snaps, fn) if snaps else fn
+
+
+@contextmanager
+def prefetched(basedir, pathsfn):
+    # With the pool on: stat the paths pathsfn() returns concurrently, into the open
+    # snapshot of basedir (one opened for the duration if there is none), so the body's
+    # stat_or_none calls are all answered from memory.  pathsfn runs under the snapshot,
+    # so any listing it does is shared with the body too.  With the pool off, nothing.
+    if not parallel():
+        yield
+        return
+    snap = snapshot_for(basedir)
+    opened = snap is None
+    if opened:
+        snap = open_snapshot(basedir)
+    try:
+        io_map(snap.stat, [p for p in pathsfn() if snapshot_for(p) is snap])
+        yield
+    finally:
+        if opened:
+            snap.close()
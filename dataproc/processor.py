@@ -1,6 +1,8 @@
 import sys
 from pathlib import Path
 import dataproc.papp
+from dataproc.matcher import compile_pathglobs
+from dataproc.scan import iter_pathglob
 from typing import Union
 name = 'processor'
 
@@ -38,7 +40,7 @@ class Pspec():
     # The string represents file(s) inside the directory
     # The string may include subdirectories
 
-    def __init__(self, specs:Union[str, Path, list]=None, dir=None, papp=None):
+    def __init__(self, specs:Union[str, Path, list]=None, dir=None, papp=None, evaluate=True):
     #def __init__(self, spec=None, dir=None, papp=None):
         self.app = papp or dataproc.papp.get_papp()
         self.dir = self.app.str2path(dir)
@@ -46,32 +48,49 @@ class Pspec():
             self.specs = [specs]
         else: self.specs = specs
 
-        self.evaluate_spec()
+        # evaluate=False: nothing is scanned yet.  Comparisons then scan only as far as
+        # they need to (see newer_than), or evaluate_spec/evaluate_pspecs do it all.
+        self.evaluated = False
+        if evaluate:
+            self.evaluate_spec()
 
     def evaluate_spec(self, specs:list=None):
         specs = specs or self.specs
-
+        # Case 1: a Path spec is a simple file.
+        # Case 2: a str spec is a pathglob.
+        # All of them matched in one walk, one stat per file (see matcher.py), and counted
+        # as the matches stream past: nothing is kept.
+        self._reset()
+        for spec, f, st in compile_pathglobs(specs).iter_matches(self.dir):
+            self._count(st.st_mtime_ns)
+        self.evaluated = True
+
+    def newer_than(self, mtime):
+        # Whether any file is newer than mtime.
+        # Unevaluated, the files are streamed and the scan stops at the first newer one,
+        # so a dirty comparison costs a handful of stats.  Only a scan that runs to the
+        # end (the answer is no) leaves the Pspec evaluated; after an early stop its
+        # counts are partial, and evaluated stays False.
+        if self.evaluated:
+            return self._biggest_mtime > mtime
+        self._reset()
+        for spec, f, st in compile_pathglobs(self.specs).iter_matches(self.dir):
+            if st.st_mtime_ns > mtime:
+                return True
+            self._count(st.st_mtime_ns)
+        self.evaluated = True
+        return False
+
+    def _reset(self):
         # Set filecount, min_mtime, max_mtime
         self.filecount = 0
         self._biggest_mtime = 0
         self._smallest_mtime = float('inf')
 
-        for spec in specs:
-            if isinstance(spec,Path):
-                # Case 1: spec is a simple file.
-                p = Path(self.dir, spec)
-                if p.is_file():
-                    self.filecount += 1
-                    self._biggest_mtime = self._smallest_mtime = p.stat().st_mtime_ns
-            else:
-                # Case 2: spec is a pathglob
-                expandedlist = expand_pathglobs(spec, self.dir)
-                for f in expandedlist:
-                    if not f.exists(): continue
-                    self.filecount += 1
-                    mt = f.stat().st_mtime_ns
-                    if mt < self._smallest_mtime: self._smallest_mtime = mt
-                    if mt > self._biggest_mtime: self._biggest_mtime = mt
+    def _count(self, mt):
+        self.filecount += 1
+        if mt < self._smallest_mtime: self._smallest_mtime = mt
+        if mt > self._biggest_mtime: self._biggest_mtime = mt
 
     def is_dirtied_by(self, child):
         return self.is_partly_older_than(child)
@@ -80,8 +99,10 @@ class Pspec():
         # "self" is older (for at least one file)
         # than this specific, non-recursive child
         # older times are smaller; older := <
-        if hasattr(other, '_smallest_mtime'):  # Another Pspec
-            return self._smallest_mtime < other._biggest_mtime
+        if not self.evaluated:
+            self.evaluate_spec()
+        if isinstance(other, Pspec):  # Another Pspec: only scanned up to its first newer file
+            return other.newer_than(self._smallest_mtime)
         elif hasattr(other, '_mtime'):  # A deptree, for example
             return self._smallest_mtime < other._mtime
         elif isinstance(other, Path):  # A file
@@ -109,13 +130,37 @@ def Processor():
         pass
 
 
+def evaluate_pspecs(pspecs):
+    # Evaluate many Pspecs together: one walk per directory for all of their specs,
+    # instead of one per Pspec.  Build them with evaluate=False to skip their own scans.
+    bydir = {}
+    for ps in pspecs:
+        ps._reset()
+        byspec = bydir.setdefault(ps.dir, {})
+        for spec in ps.specs:
+            byspec.setdefault(spec, []).append(ps)
+    for d, byspec in bydir.items():
+        for spec, f, st in compile_pathglobs(byspec).iter_matches(d):
+            for ps in byspec[spec]:
+                ps._count(st.st_mtime_ns)
+    for ps in pspecs:
+        ps.evaluated = True
+    return pspecs
+
+
 def expand_pathglobs(pathparts, basepaths=None):
+    # The list of iter_pathglobs
+    return list(iter_pathglobs(pathparts, basepaths))
+
+
+def iter_pathglobs(pathparts, basepaths=None):
     # Posted to https://stackoverflow.com/a/54936154/5368599
     # Logic:
     # 0. Argue with a Path(str).parts and optional ['/start','/dirs'].
-    # 1. for each basepath, expand out pathparts[0] into "expandedpaths"
-    # 2. If there are no more pathparts, expandedpaths is the result.
-    # 3. Otherwise, recurse with expandedpaths and the remaining pathparts.
+    # 1. for each basepath, expand out the pathparts one component at a time
+    #    with iter_pathglob (os.scandir, depth first; see scan.py).  '**' matches
+    #    any number of directories.
+    # 2. The paths matching the last component are yielded as they are found.
     # eg: expand_pathglobs('/tmp/a*/b*')
     #   --> /tmp/a1/b1
     #   --> /tmp/a2/b2
@@ -126,18 +171,13 @@ def expand_pathglobs(pathparts, basepaths=None):
         basepaths = [basepaths]
 
     if basepaths == None:
-        return expand_pathglobs(pathparts[1:], [Path(pathparts[0])])
+        yield from iter_pathglobs(pathparts[1:], [Path(pathparts[0])])
+        return
     else:
         assert pathparts[0] != '/'
 
-    expandedpaths = []
+    spec = Path(*pathparts)
     for p in basepaths:
         assert isinstance(p, Path)
-        globs = p.glob(pathparts[0])
-        for g in globs:
-            expandedpaths.append(g)
-
-    if len(pathparts) > 1:
-        return expand_pathglobs(pathparts[1:], expandedpaths)
-
-    return expandedpaths
+        for f, st in iter_pathglob(spec, p, want_stat=False):
+            yield Path(f)
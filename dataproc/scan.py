@@ -0,0 +1,179 @@
+import itertools
+import os
+import stat
+from fnmatch import fnmatchcase
+from pathlib import Path
+
+from dataproc.globcache import get_globcache, listdir
+from dataproc.snapshot import snapshot_for
+
+# Pathglob enumeration on os.scandir.
+#
+# A pathglob is matched one component at a time, like expand_pathglobs:
+#   - a literal component is joined on without touching the filesystem;
+#   - a glob component lists its directory once (os.scandir), matching names with fnmatch.
+# Directory entries carry their type, so descending needs no extra stat, and each match
+# is stat'ed at most once -- only when the caller wants its mtime.
+# A '**' component walks every directory below.
+# Paths are plain strs until the caller asks for a Path.
+#
+# Listings go through a GlobCache (globcache.py) by default, so directories which haven't
+# changed since the last scan cost one stat instead of a listing.  Under an open
+# FsSnapshot (snapshot.py) listings and stats come from the snapshot instead.
+
+GLOBCHARS = '*?['
+
+
+def has_magic(part):
+    return any(ch in part for ch in GLOBCHARS)
+
+
+def split_pathglob(spec):
+    # ('/' or '', [components]) for a str or Path pathglob
+    parts = Path(spec).parts
+    if parts and parts[0] == os.sep:
+        return os.sep, list(parts[1:])
+    return '', list(parts)
+
+
+def _matching(d, pattern, cache):
+    if cache is None:
+        return [(name, isdir) for name, isdir in listdir(d) if fnmatchcase(name, pattern)]
+    return cache.match(d, pattern)
+
+
+def scan_pathglob(spec, basedir=None, want_stat=True, cache=True):
+    # Returns [(path str, os.stat_result or None)] for every match of the pathglob spec;
+    # see iter_pathglob
+    return list(iter_pathglob(spec, basedir, want_stat, cache))
+
+
+def iter_pathglob(spec, basedir=None, want_stat=True, cache=True):
+    # Yields (path str, os.stat_result or None) for every match of the pathglob spec,
+    # relative to basedir unless spec is absolute.  Matches which vanish (or are broken
+    # symlinks) are dropped when want_stat is set; otherwise no match is stat'ed unless
+    # its last component is literal (then it must be checked for existence anyway).
+    # A '**' component matches zero or more directories, as in Path.glob (symlinked
+    # directories aren't descended into).
+    # cache: True for the open snapshot or else the shared GlobCache; a GlobCache or
+    # FsSnapshot; or False to always list.
+    #
+    # Depth first, one directory level at a time: memory is bounded by the depth times
+    # the width of one listing, and the first match comes out without waiting for the rest.
+    root, parts = split_pathglob(spec)
+    if root:
+        start = root
+    else:
+        start = str(basedir) if basedir is not None else os.curdir
+    parts = [part for i, part in enumerate(parts)
+             if not (part == '**' and i and parts[i - 1] == '**')]  # a/**/**/b: a/**/b
+    if not parts:
+        return
+
+    statfn = _stat_or_none
+    if cache is True:
+        snap = snapshot_for(_literal_prefix(start, parts))
+        if snap is not None:
+            cache = snap
+            statfn = snap.stat
+        else:
+            cache = get_globcache()
+    elif cache is False:
+        cache = None
+    elif hasattr(cache, 'stat'):
+        statfn = cache.stat
+
+    last = len(parts) - 1
+    stack = [iter([(start, 0)])]  # iterators of (directory, index of the part to match in it)
+    # With two '**' the same (directory, part) can be reached several ways (a/**/b/**/c
+    # reaches a/b/b/c twice): only then are the states visited remembered, so each
+    # match comes out once
+    seen = set() if parts.count('**') > 1 else None
+    while stack:
+        nxt = next(stack[-1], None)
+        if nxt is None:
+            stack.pop()
+            continue
+        if seen is not None:
+            if nxt in seen:
+                continue
+            seen.add(nxt)
+        d, i = nxt
+        part = parts[i]
+
+        if part == '**':
+            # zero directories: d itself goes on to the next part (or is a match);
+            # one or more: every real subdirectory stays on this part
+            if i == last:
+                st = statfn(d) if want_stat else None
+                if st is not None or not want_stat:
+                    yield d, st
+                here = []
+            else:
+                here = [(d, i + 1)]
+            stack.append(itertools.chain(here, _subdirs(d, '*', i, cache, recursive=True)))
+
+        elif i < last:
+            # only directories survive
+            if has_magic(part):
+                stack.append(_subdirs(d, part, i + 1, cache))
+            else:
+                stack.append(iter([(os.path.join(d, part), i + 1)]))
+
+        elif has_magic(part):
+            for name, isdir in _matching(d, part, cache):
+                p = os.path.join(d, name)
+                if want_stat:
+                    st = statfn(p)
+                    if st is None:
+                        continue
+                    yield p, st
+                else:
+                    yield p, None
+        else:
+            p = os.path.join(d, part)
+            st = statfn(p)
+            if st is not None:
+                yield p, st if want_stat else None
+
+
+def _subdirs(d, pattern, i, cache, recursive=False):
+    # (subdirectory, i) for the subdirectories of d matching pattern, lazily
+    for name, isdir in _matching(d, pattern, cache):
+        if isdir:
+            p = os.path.join(d, name)
+            if not (recursive and os.path.islink(p)):
+                yield p, i
+
+
+def glob_paths(directory, pattern):
+    # Path.glob(pattern) for directory, through scan_pathglob and the shared cache
+    return [Path(p) for p, st in iter_pathglob(pattern, directory, want_stat=False)]
+
+
+def _literal_prefix(start, parts):
+    # The directory every match lies under: start plus the leading literal components
+    for part in parts[:-1]:
+        if has_magic(part):
+            break
+        start = os.path.join(start, part)
+    return start
+
+
+def _stat_or_none(p):
+    try:
+        return os.stat(p)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def stat_or_none(p):
+    # os.stat(p), or None if it doesn't exist; from the open snapshot, if one covers p
+    snap = snapshot_for(p)
+    if snap is not None:
+        return snap.stat(p)
+    return _stat_or_none(p)
+
+
+def is_file(st):
+    return st is not None and stat.S_ISREG(st.st_mode)
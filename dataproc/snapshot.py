@@ -0,0 +1,142 @@
+import os
+import threading
+from fnmatch import fnmatchcase
+
+from dataproc.globcache import listdir
+
+# A one-pass snapshot of the filesystem under a basedir, shared by every node and Pspec
+# that looks at paths inside it during one evaluation.
+#   - each directory is listed at most once;
+#   - each path is stat'ed at most once, and misses are remembered as well, so
+#     not-yet-generated outputs aren't stat'ed again and again;
+#   - a path whose directory has already been listed, and isn't in the listing, is a
+#     miss without any syscall.
+#
+#   with open_snapshot(papp.basedir):
+#       ...build trees, Pspecs, evaluate...
+#
+# While a snapshot is open, scan_pathglob, scan.stat_or_none (and so Pspec, FDepTree and
+# GFDepTree) use it for every path under its basedir.  It goes stale as soon as the
+# files change: open a new one for each evaluation.
+#
+# Open snapshots are per thread: another thread's evaluation never sees this one's (soon
+# stale) snapshot.  The I/O pool's workers (parallel.py) use the snapshots of the thread
+# they're working for, through run_with(); they share its caches, and at worst two of
+# them both list the same directory.
+#
+# Opening a basedir that already has an open snapshot returns that one; it stays open
+# until every open_snapshot() has been matched by a close(), so nested withs are fine.
+# Close it on the thread that opened it.
+
+_local = threading.local()  # .open: {basedir: FsSnapshot}, replaced rather than modified
+_lock = threading.Lock()    # for the reference counts of snapshots shared with workers
+
+
+def _opened():
+    return getattr(_local, 'open', None) or {}
+
+
+def open_snapshot(basedir):
+    # This thread's open snapshot for basedir, opening one if necessary; close() it when done
+    basedir = os.path.abspath(basedir)
+    with _lock:
+        opened = _opened()
+        snap = opened.get(basedir)
+        if snap is None:
+            snap = FsSnapshot(basedir)
+            _local.open = {**opened, basedir: snap}
+        snap._refs += 1
+    return snap
+
+
+def current_snapshots():
+    # This thread's open snapshots, for run_with() on another thread
+    return _opened()
+
+
+def run_with(snapshots, fn, *args):
+    # fn(*args) with snapshots (from current_snapshots()) as this thread's open ones
+    saved = getattr(_local, 'open', None)
+    _local.open = snapshots
+    try:
+        return fn(*args)
+    finally:
+        _local.open = saved
+
+
+def snapshot_for(path):
+    # This thread's open snapshot whose basedir contains path (the innermost), or None
+    opened = _opened()
+    if not opened:
+        return None
+    path = os.path.abspath(path)
+    best = None
+    for basedir, snap in opened.items():
+        if path == basedir or path.startswith(basedir.rstrip(os.sep) + os.sep):
+            if best is None or len(basedir) > len(best.basedir):
+                best = snap
+    return best
+
+
+class FsSnapshot:
+    def __init__(self, basedir):
+        self.basedir = os.path.abspath(basedir)
+        self._listings = {}  # dir -> {name: is_dir}, or None if not a directory
+        self._stats = {}     # path -> os.stat_result, or None if missing
+        self.listed = 0
+        self.stated = 0
+        self._refs = 0  # open_snapshot() calls not yet closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with _lock:
+            self._refs -= 1
+            opened = _opened()
+            if self._refs <= 0 and opened.get(self.basedir) is self:
+                _local.open = {b: s for b, s in opened.items() if s is not self}
+
+    def refresh(self):
+        # Forget everything, for the next evaluation
+        self._listings = {}
+        self._stats = {}
+
+    def listing(self, d):
+        d = os.path.abspath(d)
+        if d not in self._listings:
+            self.listed += 1
+            entries = listdir(d)
+            if entries or os.path.isdir(d):
+                self._listings[d] = dict(entries)
+            else:
+                self._listings[d] = None
+        return self._listings[d]
+
+    def match(self, d, pattern):
+        # Same interface as GlobCache.match
+        entries = self.listing(d)
+        if not entries:
+            return []
+        return [(name, isdir) for name, isdir in entries.items() if fnmatchcase(name, pattern)]
+
+    def stat(self, p):
+        # os.stat(p), or None if p doesn't exist
+        p = os.path.abspath(p)
+        if p in self._stats:
+            return self._stats[p]
+        d, name = os.path.split(p)
+        entries = self._listings.get(d, ())
+        if entries is None or (entries != () and name not in entries):
+            st = None  # the listing already says it isn't there
+        else:
+            self.stated += 1
+            try:
+                st = os.stat(p)
+            except (FileNotFoundError, NotADirectoryError):
+                st = None
+        self._stats[p] = st
+        return st
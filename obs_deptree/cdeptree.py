@@ -0,0 +1,233 @@
+from array import array
+
+# Columnar dependency tree, for graphs too big to hold one Python object per node.
+#
+# A node is just an integer id.  Per-node data lives in parallel columns:
+#   names[i]    the node's name (or None)
+#   oldest[i]   oldest mtime of the node (its oldest output)
+#   newest[i]   newest mtime of the node (its newest input)
+# Children of i are indices[indptr[i]:indptr[i+1]]  (CSR adjacency, child order preserved)
+#
+# Same dirty rule as DepTree/GFDepTree: i is dirty iff for some child c,
+#   newest[c] > oldest[i]   or   c is dirty
+#
+# Edges are appended with add_child(); the CSR arrays are rebuilt lazily the
+# first time the graph is evaluated after a change.
+
+MTIME_MAX = 2**63 - 1  # stands in for float('inf') -- virtual roots are never dirty
+
+
+def packed_mtime(mtime):
+    if mtime == float('inf'):
+        return MTIME_MAX
+    return int(mtime)
+
+
+class CDepTree:
+    def __init__(self):
+        self.names = []
+        self.oldest = array('q')
+        self.newest = array('q')
+        self.root = None
+
+        # pending edges, in insertion order
+        self._eparent = array('q')
+        self._echild = array('q')
+
+        self._indptr = None
+        self._indices = None
+        self._orders = {}  # root id -> postorder ids, valid until the next add_child()
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_node(self, name=None, mtime=0, newest=None):
+        # Returns the new node's id.  newest defaults to mtime (a single-file node).
+        self.names.append(name)
+        self.oldest.append(packed_mtime(mtime))
+        self.newest.append(packed_mtime(mtime if newest is None else newest))
+        if self.root is None:
+            self.root = len(self.names) - 1
+        return len(self.names) - 1
+
+    def set_mtime(self, i, mtime, newest=None):
+        self.oldest[i] = packed_mtime(mtime)
+        self.newest[i] = packed_mtime(mtime if newest is None else newest)
+
+    def add_child(self, parent, child):
+        self._eparent.append(parent)
+        self._echild.append(child)
+        self._indptr = None
+        self._orders = {}
+
+    def children(self, i):
+        self._build()
+        return self._indices[self._indptr[i]:self._indptr[i + 1]]
+
+    def _build(self):
+        # Stable counting sort of the pending edges by parent; duplicate edges are dropped
+        # (as DepTree.add_child does).
+        if self._indptr is not None:
+            return
+        n = len(self.names)
+        counts = array('q', bytes(8 * (n + 1)))
+        for p in self._eparent:
+            counts[p + 1] += 1
+        for i in range(n):
+            counts[i + 1] += counts[i]
+        fill = array('q', counts)
+        indices = array('q', bytes(8 * len(self._echild)))
+        for p, c in zip(self._eparent, self._echild):
+            indices[fill[p]] = c
+            fill[p] += 1
+
+        indptr = array('q', [0])
+        kept = array('q')
+        for i in range(n):
+            row = indices[counts[i]:counts[i + 1]]
+            if len(row) > 1:
+                seen = set()
+                for c in row:
+                    if c not in seen:
+                        seen.add(c)
+                        kept.append(c)
+            else:
+                kept.extend(row)
+            indptr.append(len(kept))
+
+        self._indptr = indptr
+        self._indices = kept
+
+    def postorder(self, root=None):
+        # Bottom-up ids reachable from root, each exactly once (cf. DepTree.postorder)
+        root = self.root if root is None else root
+        order = self._orders.get(root)
+        if order is not None:
+            return order
+
+        self._build()
+        indptr, indices = self._indptr, self._indices
+        order = array('q')
+        seen = bytearray(len(self.names))
+        seen[root] = 1
+        stack = [root]
+        pos = [indptr[root]]
+        while stack:
+            node = stack[-1]
+            p = pos[-1]
+            end = indptr[node + 1]
+            while p < end and seen[indices[p]]:
+                p += 1
+            if p < end:
+                c = indices[p]
+                pos[-1] = p + 1
+                seen[c] = 1
+                stack.append(c)
+                pos.append(indptr[c])
+            else:
+                stack.pop()
+                pos.pop()
+                order.append(node)
+
+        self._orders[root] = order
+        return order
+
+    def walk(self, func, root=None):
+        # Like DepTree.walk: func(id) for every node on every path, children first.
+        root = self.root if root is None else root
+        self._build()
+        indptr, indices = self._indptr, self._indices
+        stack = [root]
+        pos = [indptr[root]]
+        while stack:
+            node = stack[-1]
+            p = pos[-1]
+            if p < indptr[node + 1]:
+                c = indices[p]
+                pos[-1] = p + 1
+                stack.append(c)
+                pos.append(indptr[c])
+            else:
+                stack.pop()
+                pos.pop()
+                func(node)
+
+    def getDirty(self, root=None):
+        # Bottom-up list of the dirty ids below root, in the same order as DepTree.getDirty
+        self._build()
+        indptr, indices = self._indptr, self._indices
+        oldest, newest = self.oldest, self.newest
+        dirty = bytearray(len(self.names))
+        dirtykids = []
+        for n in self.postorder(root):
+            mine = oldest[n]
+            for e in range(indptr[n], indptr[n + 1]):
+                c = indices[e]
+                if dirty[c] or newest[c] > mine:
+                    dirty[n] = 1
+                    dirtykids.append(n)
+                    break
+        return dirtykids
+
+    def isDirty(self, root=None):
+        root = self.root if root is None else root
+        l = self.getDirty(root)
+        return len(l) > 0 and l[-1] == root
+
+    ####################################################################################
+    # Conversion
+
+    @staticmethod
+    def from_deptree(root):
+        # Node ids follow root.topo_order(), so id i is root.topo_order()[i]
+        # and the root is the last id.
+        order = root.topo_order()
+        index = root.topo_index()
+        t = CDepTree()
+        for n in order:
+            t.add_node(n.name,
+                       mtime=getattr(n, '_min_mtime', n._mtime),
+                       newest=getattr(n, '_max_mtime', n._mtime))
+        for n in order:
+            i = index[n]
+            for c in n.children:
+                t.add_child(i, index[c])
+        t.root = index[root]
+        return t
+
+    @staticmethod
+    def from_dict_tree(tree, parent=None, ctree=None):
+        # Same spec format, and same node shapes, as DepTree.from_dict_tree.
+        # Returns the CDepTree; its root is ctree.root.
+
+        # Step 1: Create root node if necessary
+        if parent is None:
+            ctree = CDepTree()
+            if len(tree) == 1:
+                # tree root *is* the root node.
+                rootkey = list(tree)[0]
+                root = ctree.add_node(rootkey)
+                CDepTree.from_dict_tree(tree[rootkey], root, ctree)
+            elif len(tree) > 1:
+                # tree starts wide; create a virtual root node
+                root = ctree.add_node(None)
+                CDepTree.from_dict_tree(tree, root, ctree)
+            else:
+                assert False  # tree < 1 element?
+            ctree.root = root
+            return ctree
+
+        # Step 2: graft tree onto parent
+        if tree is None:
+            return
+        elif type(tree) == dict:
+            for k in tree.keys():
+                node = ctree.add_node(k)
+                ctree.add_child(parent, node)
+                CDepTree.from_dict_tree(tree[k], node, ctree)
+        elif type(tree) == list:
+            for v in tree:
+                CDepTree.from_dict_tree(v, parent, ctree)
+        else:  # leaf, presumably
+            node = ctree.add_node(tree)
+            ctree.add_child(parent, node)
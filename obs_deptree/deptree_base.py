@@ -1,5 +1,8 @@
-import inspect
-from pathlib import PosixPath
+from bisect import bisect_right
+from obs_deptree.registry import NodeRegistry
+from obs_deptree.pathtrie import PathTrie
+from obs_deptree.scc import CycleError, strongly_connected, is_cycle, find_cycle
+from obs_deptree.evaluation import EvalContext
 
 # Generalized dependency tree.
 # Think of each node as a file which...
@@ -14,6 +17,12 @@ from pathlib import PosixPath
 #
 
 class DepTree:
+    __slots__ = ('children', 'parents', '_dirty', '_mtime', 'name', '_cache', '_agg',
+                 '_version')
+
+    # Bumped by mark_changed(), for caches that also depend on mtimes.
+    _mtime_version = 0
+
     def __init__(self, children=None, name=None, mtime=0):
         if children == None:
             self.children = []
@@ -24,22 +33,62 @@ class DepTree:
         else:
             assert False
 
-        self.knownDirty = False  # IE, has not yet been shown to be dirty
+        self.parents = []  # reverse edges, maintained by add_child()
+        for c in self.children:
+            if not self in c.parents:
+                c.parents.append(self)
+
+        self._dirty = False  # knownDirty: IE, has not yet been shown to be dirty
         self._mtime = mtime
         self.name = name
+        self._cache = None  # indexes derived from the subtree below self; see _cached()
+        self._agg = None    # subtree aggregates; see build_aggregates()
+        # Bumped by add_child() anywhere below self.  Cached orderings older than this are stale.
+        # NB: editing self.children directly bypasses this; use add_child().
+        self._version = 0
+
+    @property
+    def knownDirty(self):
+        return self._dirty
+
+    @knownDirty.setter
+    def knownDirty(self, dirty):
+        # Kept in the ancestors' aggregates: a flagged node stops them being pruned
+        if dirty == self._dirty:
+            return
+        self._dirty = dirty
+        for p in self.parents:
+            if p._agg is None:
+                continue
+            if dirty:
+                p._flag_below()
+            else:
+                p._update_aggregates()
 
     def is_older_than(self, otherDepTree):
         # IE, does this specific child make Self dirty?
         return (otherDepTree._mtime > self._mtime)
 
-    def isDirty(self):
+    def newest_mtime(self):
+        return self._mtime
+
+    def oldest_mtime(self):
+        return self._mtime
+
+    def isDirty(self, memoize=False):
         # This is only for performance -- it stops recursing a tree as soon as it's known to be dirty.
+        # memoize=True: evaluate every node exactly once instead (see getDirty)
+        if memoize:
+            self._getDirty_memo()
+            return self.knownDirty
+        if self._provably_clean():
+            return self.knownDirty
 
-        # First test all immediate children
+        # First test all immediate children.  A child known to be dirty isn't compared:
+        # its mtimes (a glob, say) needn't be read at all.
         for c in self.children:
-            hasnewerchild = self.is_older_than(c)
             if (c.knownDirty == True
-            or hasnewerchild):
+            or self.is_older_than(c)):
                 self.knownDirty = True
                 break
 
@@ -56,10 +105,57 @@ class DepTree:
             c.walk(func)
         func(self)
 
-    def getDirty(self):
+    def postorder(self):
+        # Bottom-up list of every node reachable from self, each exactly once.
+        # Iterative, so deep chains don't hit the recursion limit.  A node shared by
+        # several parents appears where the recursive walk would first finish it.
+        order = []
+        seen = {self}
+        stack = [(self, iter(self.children))]
+        while stack:
+            node, kids = stack[-1]
+            for c in kids:
+                if c not in seen:
+                    seen.add(c)
+                    stack.append((c, iter(c.children)))
+                    break
+            else:
+                stack.pop()
+                order.append(node)
+        return order
+
+    def _cached(self, key, build, stamp=None):
+        # Memoizes build() on this node until the stamp (default: the structure version
+        # of the subtree below it) moves.
+        if stamp is None:
+            stamp = self._version
+        if self._cache is None:
+            self._cache = {}
+        hit = self._cache.get(key)
+        if hit is None or hit[0] != stamp:
+            hit = (stamp, build())
+            self._cache[key] = hit
+        return hit[1]
+
+    def topo_order(self):
+        # postorder(), cached until the structure changes
+        return self._cached('order', self.postorder)
+
+    def topo_index(self):
+        # node -> position in topo_order()
+        return self._cached('index', lambda: {n: i for i, n in enumerate(self.topo_order())})
+
+    def getDirty(self, memoize=False):
         # returns a bottom-up ordered list of all the dirty nodes in the tree
+        #
+        # memoize=True: DAG-aware evaluation.  Every node is visited once per call,
+        # so shared subtrees aren't re-evaluated once per path.  Same ordering.
+        # To evaluate without touching knownDirty (eg concurrently), use an EvalContext.
+        if memoize:
+            return self._getDirty_memo()
 
         dirtykids = []
+        seen = set()
         if len(self.children) == 0:
             return None  # don't want to be appending empty lists
 
@@ -70,47 +166,337 @@ class DepTree:
             if not dirtlist:
                 continue
             for d in dirtlist:
-                if not d in dirtykids:
+                if not d in seen:
                     assert isinstance(d,DepTree)
+                    seen.add(d)
                     dirtykids.append( d )
 
-        # append self, if dirty
+        # append self, if dirty.  Once it is, the remaining children aren't compared.
         for c in self.children:
-            hasnewerchild = self.is_older_than(c)
             if( c.knownDirty
-            or hasnewerchild ):
+            or self.is_older_than(c) ):
                 self.knownDirty = True
-                if not self in dirtykids:
+                if not self in seen:
                     assert isinstance(self, DepTree)
+                    seen.add(self)
                     dirtykids.append(self)
+                break
 
         if len(dirtykids) > 0:
             self.knownDirty = True
 
         return dirtykids
 
+    def _getDirty_memo(self):
+        # One EvalContext pass (see evaluation.py), with the results copied back into knownDirty
+        dirtykids = EvalContext(self, sticky=True).getDirty()
+        for n in dirtykids:
+            n.knownDirty = True
+        return dirtykids
+
+    def iterDirty(self, restat=False):
+        # Generator version of getDirty(memoize=True): yields each dirty node, bottom-up, as
+        # soon as its children are resolved.  restat=True re-reads each node's mtime just
+        # before it's needed, so a builder can start on the first dirty nodes while the rest
+        # of the tree is still being stat'ed.  Doesn't touch knownDirty (see EvalContext).
+        return EvalContext(self).iterDirty(restat)
+
+    def reset(self):
+        # Forget every knownDirty flag below self, eg before re-evaluating after a rebuild
+        for n in self.topo_order():
+            n._dirty = False
+            if n._agg is not None:
+                n._agg = n._agg[:3] + (False,)  # nothing below is flagged any more
+        for p in self.parents:
+            if p._agg is not None:
+                p._update_aggregates()
+
+    ####################################################################################
+    # Cycles
+
+    def components(self):
+        # Strongly connected components below self, children first; cached until the structure changes
+        return self._cached('scc', lambda: strongly_connected(self))
+
+    def find_cycles(self):
+        # One concrete cycle (list of nodes) per cyclic component
+        return [find_cycle(u) for u in self.components() if is_cycle(u)]
+
+    def finalize(self, condense=False):
+        # Call once the tree is built.  Raises CycleError on a dependency cycle, unless
+        # condense=True: then each cycle is evaluated as a single unit by the memoized
+        # isDirty/getDirty.  Linear in nodes + edges.
+        if not condense:
+            cycles = self.find_cycles()
+            if cycles:
+                raise CycleError(cycles[0])
+        self._cached('scc', lambda: strongly_connected(self))
+        self._cache['condense'] = condense  # a mode, not a derived index: survives structure changes
+        return self
+
     def add_child(self,child):
         # but don't add dups
         if not child in self.children:
             self.children.append(child)
+            child.parents.append(self)
+            self._structure_changed()
+            if self._agg is not None:
+                if child._agg is None:
+                    child.build_aggregates()
+                self._update_aggregates()
 
+    def _structure_changed(self):
+        # The subtree below self changed: so did those of all its ancestors (only theirs,
+        # so the caches of unrelated trees stay valid)
+        seen = {self}
+        stack = [self]
+        while stack:
+            n = stack.pop()
+            n._version += 1
+            for p in n.parents:
+                if p not in seen:
+                    seen.add(p)
+                    stack.append(p)
 
-    def get_name(self):
-        if hasattr(self,"name"):
-            return self.name
+    ####################################################################################
+    # Subtree aggregates
+    #
+    # Once built, each node carries
+    #   _agg = (newest input anywhere below it,
+    #           oldest output in its subtree (itself included, leaves excluded),
+    #           whether it is stale by mtimes,
+    #           whether any node below it is flagged knownDirty)
+    # and add_child()/mark_changed()/setting knownDirty keep them current, so is_stale()
+    # and newest_input() are O(1).  newest input <= oldest output, with nothing below
+    # flagged, proves the whole subtree clean, and evaluation skips it.
+    # NB: assigning _mtime directly bypasses this; use mark_changed().
+
+    def build_aggregates(self):
+        # One pass over the subtree, bottom-up
+        for n in self.topo_order():
+            n._agg = n._aggregate()
+
+    def _aggregate(self):
+        newest = float('-inf')
+        oldest = self.oldest_mtime() if self.children else float('inf')
+        stale = flagged = False
+        for c in self.children:
+            flagged = flagged or c._dirty
+            if c._agg is None:  # back edge of a cycle
+                continue
+            cnewest, coldest, cstale, cflagged = c._agg
+            newest = max(newest, c.newest_mtime(), cnewest)
+            oldest = min(oldest, coldest)
+            stale = stale or cstale or self.is_older_than(c)
+            flagged = flagged or cflagged
+        return (newest, oldest, stale, flagged)
 
-        # Dirty hack to give useful names for testing
-        # Search parent's globals, find first name referencing self
-        ans = []
-        frame = inspect.currentframe().f_back
-        tmp = dict(list(frame.f_globals.items()) + list(frame.f_locals.items()))
-        for k, var in tmp.items():
-            if k == 'self': continue
-            if isinstance(var, self.__class__):
-                if hash(self) == hash(var):
-                    return k
+    def _update_aggregates(self):
+        # Recompute self, then ancestors for as long as something changes
+        stack = [self]
+        while stack:
+            n = stack.pop()
+            agg = n._aggregate()
+            if agg != n._agg:
+                n._agg = agg
+                stack.extend(p for p in n.parents if p._agg is not None)
+
+    def _flag_below(self):
+        # A node below self was just flagged: so self and its ancestors have one below
+        stack = [self]
+        while stack:
+            n = stack.pop()
+            if n._agg is None or n._agg[3]:
+                continue  # ...and so, already, has everything above it
+            n._agg = n._agg[:3] + (True,)
+            stack.extend(n.parents)
+
+    def _provably_clean(self, flags=True):
+        # flags=False: ignoring the knownDirty flags below (an evaluation that isn't sticky)
+        agg = self._agg
+        return agg is not None and agg[0] <= agg[1] and not (flags and agg[3])
+
+    def is_stale(self):
+        if self._agg is None:
+            self.build_aggregates()
+        return self._agg[2]
+
+    def newest_input(self):
+        if self._agg is None:
+            self.build_aggregates()
+        return self._agg[0]
+
+    ####################################################################################
+    # Incremental updates
+
+    def refresh_mtime(self):
+        # Re-read this node's mtime from wherever it comes from.  Virtual here.
+        pass
+
+    def mark_changed(self, mtime=None):
+        # This node changed: take the argued mtime (or re-read it), then mark the ancestors
+        # it now dirties.  Only reverse edges are followed, so the cost is proportional to
+        # the affected ancestors rather than to the whole tree.
+        # Returns the newly dirtied nodes.
+        if mtime is None:
+            self.refresh_mtime()
+        else:
+            self._mtime = mtime
+        self._mtime_changed()
+        return self.dirty_ancestors()
+
+    def dirty_ancestors(self):
+        # Marks the ancestors this node now dirties (by its mtime or its own knownDirty);
+        # returns the newly dirtied ones.
+        newlydirty = []
+        stack = [self]
+        while stack:
+            n = stack.pop()
+            for p in n.parents:
+                if p.knownDirty:
+                    continue  # ...and so, already, is everything above it
+                if n.knownDirty or p.is_older_than(n):
+                    p.knownDirty = True
+                    newlydirty.append(p)
+                    stack.append(p)
+        return newlydirty
+
+    def restat(self):
+        # refresh_mtime(), keeping mtime-derived caches in step.  True if the mtime changed.
+        before = (self.oldest_mtime(), self.newest_mtime())
+        self.refresh_mtime()
+        if (self.oldest_mtime(), self.newest_mtime()) == before:
+            return False
+        self._mtime_changed()
+        return True
+
+    def _mtime_changed(self):
+        DepTree._mtime_version += 1
+        if self._agg is not None:
+            self._update_aggregates()
+        for p in self.parents:
+            if p._agg is not None:
+                p._update_aggregates()
+
+    def invalidate(self, node_or_path, mtime=None):
+        # mark_changed() on a node of this tree, given the node or its file path.
+        # Returns the newly dirtied nodes.
+        if isinstance(node_or_path, DepTree):
+            return node_or_path.mark_changed(mtime)
+
+        newlydirty = []
+        nodes = self.registry().find_all(path=node_or_path)
+        if not nodes:
+            # a new file under a leaf glob: it becomes a child of the nodes it's an input of
+            nodes = [o.add_leaf(node_or_path) for o in self.leaf_owners([node_or_path])]
+        for n in nodes:
+            if n is not None:
+                newlydirty.extend(n.mark_changed(mtime))
+        return newlydirty
+
+    def dependents(self, nodes):
+        # Every node of this tree that depends, directly or not, on any of nodes; bottom-up.
+        index = self.topo_index()
+        found = set()
+        stack = list(nodes)
+        while stack:
+            n = stack.pop()
+            for p in n.parents:
+                if p not in found and p in index:
+                    found.add(p)
+                    stack.append(p)
+        return sorted(found, key=index.__getitem__)
+
+    ####################################################################################
+    # Lookup
+
+    def path_trie(self):
+        # PathTrie of every file and glob node below self, cached until the structure changes
+        return self._cached('trie', lambda: PathTrie.from_tree(self))
+
+    def add_leaf_glob(self, pattern):
+        # Records a glob (a Path pattern) whose matches were made self's children, so a
+        # file matching it later is still known to belong here (leaf_owners)
+        if self._cache is None:
+            self._cache = {}
+        self._cache.setdefault('leafglobs', []).append(pattern)  # part of the spec: survives structure changes
+        self._structure_changed()
+
+    def leaf_globs(self):
+        return self._cache.get('leafglobs', ()) if self._cache else ()
+
+    def leaf_owners(self, paths):
+        # Nodes with a leaf glob matching any of paths: what a new file there is an input of
+        trie = self.path_trie()
+        found = []
+        seen = set()
+        for p in paths:
+            for n in trie.lookup(p, owners=True):
+                if n not in seen:
+                    seen.add(n)
+                    found.append(n)
+        return found
+
+    def add_leaf(self, path):
+        # The child for a file matching one of self's leaf globs, created if it's new.
+        # Virtual here.
         return None
 
+    def watchers(self, paths):
+        # Nodes whose file or glob covers any of paths
+        trie = self.path_trie()
+        found = []
+        seen = set()
+        for p in paths:
+            for n in trie.lookup(p):
+                if n not in seen:
+                    seen.add(n)
+                    found.append(n)
+        return found
+
+    def affected_targets(self, paths):
+        # Every target needing a rebuild because of a change to any of paths, bottom-up:
+        # the dependents of the nodes watching them, and the nodes a new file there
+        # would be an input of.  Uses the trie only; nothing is stat'ed or globbed.
+        owners = self.leaf_owners(paths)
+        found = set(self.dependents(self.watchers(paths) + owners)).union(owners)
+        index = self.topo_index()
+        return sorted(found, key=index.__getitem__)
+
+    def mtime_index(self):
+        # (leaves sorted by newest mtime, their mtimes), cached until the structure
+        # changes or mark_changed() is called anywhere
+        def build():
+            leaves = [n for n in self.topo_order() if not n.children]
+            leaves.sort(key=lambda n: n.newest_mtime())
+            return leaves, [n.newest_mtime() for n in leaves]
+        stamp = (self._version, DepTree._mtime_version)
+        return self._cached('mtimes', build, stamp)
+
+    def changed_since(self, t):
+        # Returns (leaves modified after t, every target depending on them).
+        # Bisects the sorted index: O(log n + k) rather than a full walk.
+        leaves, mtimes = self.mtime_index()
+        changed = leaves[bisect_right(mtimes, t):]
+        return changed, self.dependents(changed)
+
+    def registry(self):
+        # NodeRegistry of every node below self, cached until the structure changes
+        return self._cached('registry', lambda: NodeRegistry.from_tree(self))
+
+    def find(self, name):
+        return self.registry().find(name)
+
+    def find_path(self, path):
+        return self.registry().find_path(path)
+
+
+    def get_name(self):
+        if self.name != None:
+            return self.name
+        # Unnamed, eg a virtual root
+        return '<%s %#x>' % (type(self).__name__, id(self))
+
     def __str__(self):
         return ("%s: %r" % (self.get_name(), self.knownDirty))
 
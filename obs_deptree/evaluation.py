@@ -0,0 +1,141 @@
+# Evaluation contexts.
+#
+# An EvalContext holds the dirty state of one evaluation of a tree, in a bytearray indexed
+# by the root's topo_index(), instead of in the nodes' knownDirty flags.  Nodes are only
+# read, so any number of contexts -- eg one per thread or per request -- can evaluate one
+# shared tree at once, and each evaluation starts from the current mtimes.
+#
+# A context can also evaluate a forest: several targets at once.  Their union graph is
+# evaluated once and per-target dirty lists are read off the shared results, so
+# subtrees shared between targets are only compared (and stat'ed) once.
+#
+# iterDirty() streams the result: each dirty node is yielded as soon as its children are
+# resolved, optionally re-stat'ing nodes on the way, so builders needn't wait for the walk.
+#
+# Build the tree's cached indexes, and glob and stat its deferred nodes (prepare()),
+# before sharing it between threads; after that evaluation is read-only.
+
+
+from obs_deptree.scc import strongly_connected
+
+
+def prepare(root):
+    # Builds every cached index an evaluation reads, and reads every mtime once, so
+    # glob nodes and lazy nodes aren't globbed or stat'ed for the first time mid-evaluation
+    for n in root.topo_order():
+        n.oldest_mtime()
+        n.newest_mtime()
+    root.topo_index()
+    if root._cache.get('condense'):
+        root.components()
+    return root
+
+
+def union_order(targets):
+    # Bottom-up order of every node below any of targets, each once.  Concatenating the
+    # targets' own (cached) orders keeps children ahead of parents.
+    order = []
+    seen = set()
+    for t in targets:
+        for n in t.topo_order():
+            if n not in seen:
+                seen.add(n)
+                order.append(n)
+    return order
+
+
+def evaluate_forest(targets, sticky=False):
+    # {target: its dirty list} for every target, from one shared evaluation
+    ctx = EvalContext(list(targets), sticky)
+    ctx.evaluate()
+    return {t: ctx.getDirty(t) for t in ctx.targets}
+
+
+class EvalContext:
+    def __init__(self, root, sticky=False):
+        # root: the node to evaluate, or a list of targets to evaluate as a forest.
+        # sticky=True also treats nodes already flagged knownDirty as dirty
+        self.sticky = sticky
+        if isinstance(root, list):
+            self.root = None
+            self.targets = root
+            self.order = union_order(root)
+            self.index = {n: i for i, n in enumerate(self.order)}
+        else:
+            self.root = root
+            self.targets = [root]
+            self.order = root.topo_order()
+            self.index = root.topo_index()
+        self.dirty = bytearray(len(self.order))
+        self._dirtykids = None
+
+    def _condensed(self):
+        return any(t._cache.get('condense') for t in self.targets)
+
+    def _components(self):
+        if self.root is not None:
+            return self.root.components()
+        return strongly_connected(self.targets)
+
+    def _is_dirty_child(self, c):
+        return self.dirty[self.index[c]] or (self.sticky and c.knownDirty)
+
+    def evaluate(self):
+        # Bottom-up list of the dirty nodes; computed once per context
+        if self._dirtykids is None:
+            self._dirtykids = list(self.iterDirty())
+        return self._dirtykids
+
+    def iterDirty(self, restat=False):
+        # Yields the dirty nodes bottom-up, each as soon as all of its children are resolved.
+        # restat=True: restat() every node as it's reached (children before parents).
+        if self._condensed():
+            yield from self._iter_units(restat)
+            return
+
+        dirty, index, sticky = self.dirty, self.index, self.sticky
+        for i, n in enumerate(self.order):
+            if restat:
+                n.restat()
+            elif n._provably_clean(sticky) and not (sticky and n.knownDirty):
+                continue
+            for c in n.children:
+                if (dirty[index[c]]
+                or (sticky and c.knownDirty)
+                or n.is_older_than(c)):
+                    dirty[i] = 1
+                    yield n
+                    break
+
+    def _iter_units(self, restat):
+        # Over the strongly connected components of a finalize(condense=True)'d tree.
+        # A cycle is one unit: all of it is dirty if any member has a dirty or newer child
+        # outside it (mtimes within the cycle can't all be ordered).
+        for unit in self._components():
+            if restat:
+                for n in unit:
+                    n.restat()
+            members = set(unit)
+            for n in unit:
+                if any(c not in members
+                       and (self._is_dirty_child(c) or n.is_older_than(c))
+                       for c in n.children):
+                    break
+            else:
+                continue
+            for n in unit:
+                self.dirty[self.index[n]] = 1
+            yield from unit
+
+    def getDirty(self, target=None):
+        # All dirty nodes, or just those below target, bottom-up
+        l = self.evaluate()
+        if target is None or target is self.root:
+            return list(l)
+        dirty, index = self.dirty, self.index
+        return [n for n in target.topo_order() if dirty[index[n]]]
+
+    def isDirty(self, node=None):
+        self.evaluate()
+        node = self.root if node is None else node
+        return bool(self.dirty[self.index[node]])
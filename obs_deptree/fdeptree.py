@@ -1,11 +1,21 @@
 from pathlib import Path
 from obs_deptree.deptree_base import DepTree
+from obs_deptree.pathtable import PathTable
+from obs_deptree.registry import NodeRegistry
+from dataproc.parallel import io_map, prefetched
+from dataproc.scan import glob_paths, stat_or_none
 
 # Dependency tree specialized for files
 # A node is a single file/directory
+#
+# Paths are interned in FDepTree.paths (see pathtable.py); nodes only hold a
+# directory id and a basename, and self.filepath rebuilds the Path.
 
 class FDepTree(DepTree):
+    __slots__ = ('_dirid', '_basename')
+
     default_dir = Path.home()
+    paths = PathTable()  # shared by every FDepTree/GFDepTree
 
     def __init__(self, children=None, name=None, filepath = None):
         super().__init__(children=children)
@@ -20,14 +30,43 @@ class FDepTree(DepTree):
             assert isinstance(filepath,Path)
             if self.name == None: self.name = filepath.parts[-1]
 
-            if filepath.exists():
-                self._mtime = filepath.stat().st_mtime_ns
-            else:
-                self._mtime = 0 # always assumed dirty
+            self.refresh_mtime()
+
+    @property
+    def filepath(self):
+        if self._dirid is None:
+            return None
+        return FDepTree.paths.path(self._dirid, self._basename)
+
+    @filepath.setter
+    def filepath(self, filepath):
+        if filepath is None:
+            self._dirid = self._basename = None
+        else:
+            self._dirid, self._basename = FDepTree.paths.intern(filepath)
+
+    def refresh_mtime(self):
+        if self.filepath == None:
+            return
+        st = stat_or_none(self.filepath)  # one stat, or none under an open snapshot
+        if st != None:
+            self._mtime = st.st_mtime_ns
+        else:
+            self._mtime = 0 # always assumed dirty
 
     def __str__(self):
         return ("%s: %r (%s)" % (self.get_name(), self.knownDirty,self.filepath))
 
+    def add_leaf(self, path):
+        # As from_dict_tree would make it now, if it isn't already a child
+        path = Path(path)
+        for c in self.children:
+            if c.filepath == path:
+                return c
+        node = type(self)(name=path.parts[-1], filepath=path)
+        self.add_child(node)
+        return node
+
     @staticmethod
     def expand_glob_to_nodes(globlist, filepath=Path.cwd(), children=None):
         # Returns a list of FDepTrees from the argued glob strings
@@ -37,7 +76,7 @@ class FDepTree(DepTree):
 
         results = []
         for g in globlist:
-            files = filepath.glob(g)
+            files = glob_paths(filepath, g)
             results.extend(files)
 
         nodes = []
@@ -48,26 +87,41 @@ class FDepTree(DepTree):
         return nodes
 
     @staticmethod
-    def from_dict_tree(tree, parent=None, filedir = None):
+    def from_dict_tree(tree, parent=None, filedir = None, registry=None, lazy=False):
         # Same as in deptree, but every leaf might represents
         # a glob of filenames in workdir
+        #
+        # Nodes are created through registry, so a file that appears more than once
+        # in the spec becomes a single shared node.
+        #
+        # lazy=True: only the root is created.  Each node creates (and globs) its children
+        # the first time they're asked for, and stats its file the first time its mtime
+        # is asked for -- see LazyFDepTree.  No cycle check: that would expand everything.
         workdir = filedir or FDepTree.default_dir
         assert isinstance(workdir, Path)
 
         # Step 1: Create root node if necessary
         if parent==None:
+            newregistry = registry == None
+            if newregistry: registry = NodeRegistry()
             # Create and return the root node
             if len(tree) == 1:
                 # tree root *is* the root node.
-                rootkey = list(tree)[0]
-                root = FDepTree()
-                FDepTree.from_dict_tree(tree[rootkey], root,filedir = workdir)
-            elif len(tree) > 1:
-                # tree starts wide; create a virtual root node
-                root = FDepTree()
-                FDepTree.from_dict_tree(tree, root)
-            else:
+                tree = tree[list(tree)[0]]
+            elif len(tree) < 1:
                 assert False # tree < 1 element?
+            # else tree starts wide; the root node is virtual either way
+
+            if lazy:
+                root = registry.register(LazyFDepTree(spec=(tree, workdir, registry)))
+                return root
+            # With the I/O pool on, every file is stat'ed concurrently first
+            with prefetched(workdir, lambda: spec_paths(tree, workdir)):
+                root = registry.register(FDepTree())
+                FDepTree.from_dict_tree(tree, root, workdir, registry)
+            if newregistry:
+                root._cached('registry', lambda: registry)
+            root.finalize()  # shared nodes could close a cycle
             return root
 
         # Step 2: graft tree onto parent
@@ -77,18 +131,146 @@ class FDepTree(DepTree):
         elif type(tree) == dict:
             # grafts every element in tree as a child of parent
             for k in tree.keys():
-                node = FDepTree(name=k, filepath=Path(workdir,k))
+                p = Path(workdir,k)
+                if lazy:
+                    node = registry.get_or_create(p, lambda: LazyFDepTree(name=k, filepath=p))
+                    node.add_spec((tree[k], workdir, registry))
+                    parent.add_child(node)
+                    continue
+                node = registry.get_or_create(p, lambda: FDepTree(name=k, filepath=p))
                 parent.add_child(node)
-                FDepTree.from_dict_tree(tree[k], node, filedir = workdir)
+                FDepTree.from_dict_tree(tree[k], node, workdir, registry)
         elif type(tree) == list:
             for v in tree:
-                FDepTree.from_dict_tree(v, parent, filedir = workdir)
+                FDepTree.from_dict_tree(v, parent, workdir, registry, lazy)
         else:  # leaf, presumably
-            for f in workdir.glob(tree):
+            cls = LazyFDepTree if lazy else FDepTree
+            parent.add_leaf_glob(Path(workdir, tree))
+            for f in glob_paths(workdir, tree):
                 fn = f.parts[-1]
-                node = FDepTree(name=fn, filepath=f)
+                node = registry.get_or_create(f, lambda: cls(name=fn, filepath=f))
                 parent.add_child(node)
 
+    @staticmethod
+    def lazy_target(tree, key, filedir=None):
+        # A lazy node for the target named key, wherever it appears in the spec.
+        # Only the spec is searched: nothing outside that target's subgraph is created or stat'ed.
+        workdir = filedir or FDepTree.default_dir
+        spec = find_in_spec(tree, key)
+        registry = NodeRegistry()
+        node = registry.register(LazyFDepTree(name=key, filepath=Path(workdir, key)))
+        node.add_spec((spec, workdir, registry))
+        return node
+
+
+def spec_paths(tree, workdir, expand_leaves=True):
+    # Every file a from_dict_tree spec names: its keys, and the matches of its leaf globs
+    # (globbed concurrently with the I/O pool on)
+    paths, leaves = [], []
+    stack = [tree]
+    while stack:
+        t = stack.pop()
+        if type(t) == dict:
+            paths.extend(Path(workdir, k) for k in t)
+            stack.extend(t.values())
+        elif type(t) == list:
+            stack.extend(t)
+        elif t != None:
+            leaves.append(t)
+    if expand_leaves:
+        for files in io_map(lambda g: glob_paths(workdir, g), leaves, key=lambda g: workdir):
+            paths.extend(files)
+    return paths
+
+def find_in_spec(tree, key):
+    # The subtree spec under key, searching a from_dict_tree spec depth-first
+    stack = [tree]
+    while stack:
+        t = stack.pop()
+        if type(t) == dict:
+            if key in t:
+                return t[key]
+            stack.extend(reversed(list(t.values())))
+        elif type(t) == list:
+            stack.extend(reversed(t))
+    assert False, "%s is not in the spec" % key
+
+
+class LazyNode:
+    # Mixin for lazily built file nodes.
+    #   _lazy      specs still to be grafted on as children, [(spec, workdir, registry...)];
+    #              False once the children have been created, None while constructing
+    #   _deferred  True until the file has been stat'ed
+    # children and _mtime are properties over DepTree's own slots, so the rest of the
+    # code can't tell the difference -- it just triggers the work on first access.
+    __slots__ = ()
+
+    def _lazy_init(self):
+        self._lazy = None
+        self._deferred = True
+
+    def add_spec(self, spec):
+        if spec[0] == None:
+            return
+        if self._lazy is False:
+            self._graft(spec)  # children were already created: graft now
+        else:
+            self._lazy.append(spec)
+
+    @property
+    def children(self):
+        if self._lazy:
+            specs, self._lazy = self._lazy, False
+            for spec in specs:
+                self._graft(spec)
+        elif self._lazy is not None:
+            self._lazy = False
+        return DepTree.children.__get__(self)
+
+    @children.setter
+    def children(self, children):
+        DepTree.children.__set__(self, children)
+
+    @property
+    def _mtime(self):
+        if self._deferred:
+            self._deferred = False
+            self.refresh_mtime()
+        return super()._mtime  # the next class's: GFDepTree globs on first access too
+
+    @_mtime.setter
+    def _mtime(self, mtime):
+        DepTree._mtime.__set__(self, mtime)
+
+    def refresh_mtime(self):
+        if self._deferred:
+            return  # not until someone asks
+        super().refresh_mtime()
+
+    def mark_changed(self, mtime=None):
+        # Stat first, so the first access can't later overwrite the argued mtime
+        self._mtime
+        return super().mark_changed(mtime)
+
+    def is_expanded(self):
+        # Have the children been created and the file stat'ed yet?
+        return self._lazy is False and not self._deferred
+
+
+class LazyFDepTree(LazyNode, FDepTree):
+    __slots__ = ('_lazy', '_deferred')
+
+    def __init__(self, children=None, name=None, filepath=None, spec=None):
+        self._lazy_init()
+        super().__init__(children=children, name=name, filepath=filepath)
+        self._lazy = []
+        if spec != None:
+            self.add_spec(spec)
+
+    def _graft(self, spec):
+        tree, workdir, registry = spec
+        FDepTree.from_dict_tree(tree, self, workdir, registry, lazy=True)
+
 if __name__ == '__main__':
 #def eg2():
     treeg= {'root': { 'b1': 'c*'
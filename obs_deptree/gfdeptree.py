@@ -1,20 +1,32 @@
+import threading
 from pathlib import Path
 from obs_deptree.deptree_base import DepTree
 
 # Dependency tree specialized for files
 # A node is defined by a  glob string indicating a file path.
-from obs_deptree.fdeptree import FDepTree
+from obs_deptree.fdeptree import FDepTree, LazyNode, find_in_spec, spec_paths
+from obs_deptree.registry import NodeRegistry
+from dataproc.matcher import compile_pathglobs
+from dataproc.parallel import prefetched
+from dataproc.scan import glob_paths
+
+# Publishes a glob's oldest/newest mtimes as a pair (see GFDepTree._expand)
+_expand_lock = threading.Lock()
 
 class Dnode():
     # This is a single node in a dependency tree.
+    __slots__ = ('children', 'name', 'filepath', 'globstr')
+
     def __init__(self
-                 , children=[]
+                 , children=None
                  , name=None
                  , filepath=None
                  , globstr=None):
 
+        if children is None:
+            children = []
         assert isinstance(children,list)
-        self.children = list
+        self.children = children
 
         assert (name is None) or isinstance(name,str)
         self.name = name
@@ -26,45 +38,105 @@ class Dnode():
         self.globstr = globstr
 
 
-class DTree(DepTree):
-    default_dir = Path.home()
-
-    def __init__(self, root=None):
-        super().__init__(root)
-
-        self.basedir = self.default_dir
-        if filepath:
-            if filepath.isfile():
-                self.basedir = filepath.parent
-            else:
-                self.basedir = filepath
-
-        if (filepath == None) & (globstr == None):
-            # Virtual root node, in case there are *many* top-level ones
-            self._min_mtime = float('inf') # Never dirty.
-        elif globstr == None:
-            # Standard filepath node
-            self.filepath = Path(filepath)  # permit string paths
-            assert isinstance(filepath,Path)
-            if not name:
-                self.name = filepath.parts[-1]
-
-            if filepath.exists():
-                self._max_mtime = self._min_mtime = filepath.stat().st_mtime_ns
-            else:
-                self._max_mtime = self._min_mtime = 0 # Not-yet-generated; always dirty.
-        else:
-            # globstr is defined; matches many files.
-            # If filepath is also defined, it's a directory to prepend to the globstr
-            p = Path(filepath or self.default_dir)
-            self.get_glob_mtimes(p,globstr)
-
+class GFDepTree(FDepTree):
+    # A node is either
+    #   a single file (filepath),
+    #   a glob (globstr) matching many files inside directory filepath (default: default_dir),
+    #   or a virtual root (neither).
+    # Many files means an oldest and a newest mtime rather than a single one; _mtime
+    # mirrors the newest, so plain DepTree parents compare against that.
+    #
+    # A glob node doesn't glob when it's created: its files are globbed and stat'ed on
+    # the first access to its mtimes.  A parent already known to be dirty through
+    # another child never compares against it (see isDirty), so it never globs at all.
+    __slots__ = ('globstr', '_glob_min', '_glob_max', 'basedir')
+
+    def __init__(self, children=None, name=None, filepath=None, globstr=None):
+        self.globstr = globstr
+        self._glob_min = float('inf')
+        self._glob_max = None if globstr != None else float('inf')  # None: not globbed yet
+        super().__init__(children=children, name=name or globstr, filepath=filepath)
+
+    def refresh_mtime(self):
+        if self.globstr == None:
+            # Standard filepath node (0 if not-yet-generated; always dirty.)
+            super().refresh_mtime()
+            self._glob_min = self._glob_max = DepTree._mtime.__get__(self)
+        elif self._glob_max != None:
+            # globstr is defined; matches many files.  Re-glob now; while it's still
+            # pending, the first access will read fresh mtimes anyway.
+            self._expand()
+
+    def _expand(self):
+        # If filepath is also defined, it's a directory to prepend to the globstr.
+        # The mtimes are only published once the glob is done, _glob_max last: until then
+        # another thread sees the node still pending (and globs it too) or its old mtimes,
+        # never a half-done glob.
+        lo, hi = self.get_glob_mtimes(self.filepath or self.default_dir, self.globstr)
+        with _expand_lock:
+            self._glob_min = lo
+            DepTree._mtime.__set__(self, hi)
+            self._glob_max = hi
+
+    def is_expanded(self):
+        return self._glob_max != None
+
+    @property
+    def _mtime(self):
+        if self._glob_max == None:
+            self._expand()
+        return DepTree._mtime.__get__(self)
+
+    @_mtime.setter
+    def _mtime(self, mtime):
+        DepTree._mtime.__set__(self, mtime)
+
+    @property
+    def _min_mtime(self):
+        if self._glob_max == None:
+            self._expand()
+        return self._glob_min
+
+    @_min_mtime.setter
+    def _min_mtime(self, mtime):
+        self._glob_min = mtime
+
+    @property
+    def _max_mtime(self):
+        if self._glob_max == None:
+            self._expand()
+        return self._glob_max
+
+    @_max_mtime.setter
+    def _max_mtime(self, mtime):
+        self._glob_max = mtime
+
+    def mark_changed(self, mtime=None):
+        # A file node just has a new mtime.  For a glob, an explicit mtime can only be
+        # taken as a new newest mtime; mtime=None re-globs for an exact oldest/newest.
+        if mtime != None and self.globstr == None:
+            self._min_mtime = self._max_mtime = mtime
+        elif mtime != None:
+            self._max_mtime = max(self._max_mtime, mtime)
+            mtime = self._max_mtime
+        return super().mark_changed(mtime)
+
+    def newest_mtime(self):
+        return self._max_mtime
+
+    def oldest_mtime(self):
+        return self._min_mtime
 
     def get_glob_mtimes(self,filepath,globstr):
-        for f in filepath.glob(globstr):
-            mt = f.stat().st_mtime_ns
-            if mt < self._min_mtime: self._min_mtime = mt
-            if mt > self._max_mtime: self._max_mtime = mt
+        # (oldest, newest) mtime of the files matching globstr in filepath; (inf, 0) if none.
+        # Listings come from the shared glob cache (dataproc/globcache.py); matches are
+        # stat'ed across the I/O pool when it's on (dataproc/parallel.py)
+        lo, hi = float('inf'), 0
+        for spec, f, st in compile_pathglobs([globstr]).iter_matches(filepath):
+            mt = st.st_mtime_ns
+            if mt < lo: lo = mt
+            if mt > hi: hi = mt
+        return lo, hi
 
     def is_older_than(self,childGFDepTree):
         # This specific, non-recursive child makes Self dirty iff...
@@ -79,69 +151,83 @@ class DTree(DepTree):
     # Generation
 
     @staticmethod
-    def expand_glob_to_nodes(globlist, filepath=Path.cwd(), children=None):
-        # Returns a list of FDepTrees from the argued glob strings
-
-        if type(globlist) == str:
-            globlist = [globlist]
-
-        results = []
-        for g in globlist:
-            files = filepath.glob(g)
-            results.extend(files)
-
-        nodes = []
-        for f in results:
-            c = FDepTree(filepath = f, children=children)
-            nodes.append( c )
-
-        return nodes
-
-    @staticmethod
-    def from_dict_tree(tree, parent=None, filedir = None, expand_leaves=True):
+    def from_dict_tree(tree, parent=None, filedir = None, expand_leaves=True, registry=None, lazy=False):
         # Same as in deptree, but every leaf might represent
         # a glob of filenames in filedir
         #
         # expand_leaves = False: keep the leaves as globs.
+        # Nodes are created through registry, as in FDepTree.from_dict_tree.
+        # lazy=True: create, glob and stat nodes only on demand, as in FDepTree.from_dict_tree.
 
-        assert not expand_leaves # not implemented!
-
-        workdir = filedir or FDepTree.default_dir
+        workdir = filedir or GFDepTree.default_dir
         assert isinstance(workdir, Path)
+        cls = LazyGFDepTree if lazy else GFDepTree
 
         # Step 1: Create root node if necessary
         if parent==None:
+            newregistry = registry == None
+            if newregistry: registry = NodeRegistry()
             # Create and return the root node
             if len(tree) == 1:
                 # tree root *is* the root node.
                 rootkey = list(tree)[0]
-                root = GFDepTree(name=rootkey, filepath=self.str2path(rootkey))
-                FDepTree.from_dict_tree(tree[rootkey], root)
+                p = Path(workdir, rootkey)
+                root = registry.get_or_create(p, lambda: cls(name=rootkey, filepath=p))
+                tree = tree[rootkey]
             elif len(tree) > 1:
                 # tree starts wide; create a virtual root node
-                root = FDepTree()
-                FDepTree.from_dict_tree(tree, root)
+                root = registry.register(cls())
             else:
                 assert False # tree < 1 element?
+
+            if lazy:
+                root.add_spec((tree, workdir, registry, expand_leaves))
+                return root
+            # With the I/O pool on, every file below is stat'ed concurrently first
+            with prefetched(workdir, lambda: spec_paths(tree, workdir, expand_leaves)):
+                GFDepTree.from_dict_tree(tree, root, workdir, expand_leaves, registry)
+            if newregistry:
+                root._cached('registry', lambda: registry)
+            root.finalize()  # shared nodes could close a cycle
             return root
 
         # Step 2: graft tree onto parent
-        assert isinstance(parent, FDepTree)
+        assert isinstance(parent, GFDepTree)
         if tree == None:
             return
         elif type(tree) == dict:
             # grafts every element in tree as a child of parent
             for k in tree.keys():
-                node = FDepTree()
+                p = Path(workdir, k)
+                node = registry.get_or_create(p, lambda: cls(name=k, filepath=p))
                 parent.add_child(node)
-                FDepTree.from_dict_tree(tree[k], node)
+                if lazy:
+                    node.add_spec((tree[k], workdir, registry, expand_leaves))
+                else:
+                    GFDepTree.from_dict_tree(tree[k], node, workdir, expand_leaves, registry)
         elif type(tree) == list:
             for v in tree:
-                FDepTree.from_dict_tree(v, parent)
-        else:  # leaf, presumably
-            for f in workdir.glob(tree):
-                node = FDepTree(name=f)
+                GFDepTree.from_dict_tree(v, parent, workdir, expand_leaves, registry, lazy)
+        elif expand_leaves:
+            parent.add_leaf_glob(Path(workdir, tree))
+            for f in glob_paths(workdir, tree):
+                node = registry.get_or_create(f, lambda: cls(name=f.parts[-1], filepath=f))
                 parent.add_child(node)
+        else:  # one node watching every file matching the glob
+            node = registry.get_or_create(Path(workdir, tree),
+                                          lambda: cls(filepath=workdir, globstr=tree))
+            parent.add_child(node)
+
+    @staticmethod
+    def lazy_target(tree, key, filedir=None, expand_leaves=True):
+        # As FDepTree.lazy_target
+        workdir = filedir or GFDepTree.default_dir
+        spec = find_in_spec(tree, key)
+        registry = NodeRegistry()
+        p = Path(workdir, key)
+        node = registry.register(LazyGFDepTree(name=key, filepath=p))
+        node.add_spec((spec, workdir, registry, expand_leaves))
+        return node
 
     ####################################################################################
     # Utility
@@ -165,6 +251,40 @@ class DTree(DepTree):
         return ("%s: %r (%s)" % (self.get_name(), self.knownDirty, self.filepath))
 
 
+class LazyGFDepTree(LazyNode, GFDepTree):
+    # See LazyNode.  A glob node's glob runs on first access to its mtimes.
+    __slots__ = ('_lazy', '_deferred')
+
+    def __init__(self, children=None, name=None, filepath=None, globstr=None, spec=None):
+        self._lazy_init()
+        super().__init__(children=children, name=name, filepath=filepath, globstr=globstr)
+        self._lazy = []
+        if spec != None:
+            self.add_spec(spec)
+
+    def _graft(self, spec):
+        tree, workdir, registry, expand_leaves = spec
+        GFDepTree.from_dict_tree(tree, self, workdir, expand_leaves, registry, lazy=True)
+
+    @property
+    def _min_mtime(self):
+        self._mtime  # stat, if not yet done
+        return GFDepTree._min_mtime.__get__(self)
+
+    @_min_mtime.setter
+    def _min_mtime(self, mtime):
+        GFDepTree._min_mtime.__set__(self, mtime)
+
+    @property
+    def _max_mtime(self):
+        self._mtime
+        return GFDepTree._max_mtime.__get__(self)
+
+    @_max_mtime.setter
+    def _max_mtime(self, mtime):
+        GFDepTree._max_mtime.__set__(self, mtime)
+
+
 if __name__ == '__main__':
 #def eg2():
     treeg= {'root': { 'b1': 'c*'
@@ -172,5 +292,5 @@ if __name__ == '__main__':
 
     GFDepTree.default_dir = Path('/tmp/test')
 
-    root = FDepTree.from_dict_tree(treeg, None)
+    root = GFDepTree.from_dict_tree(treeg, None)
     root.walk(print)
@@ -0,0 +1,95 @@
+from obs_deptree.cdeptree import CDepTree
+
+try:
+    import numpy as np
+except ImportError:  # optional; LevelEngine needs it
+    np = None
+
+# Vectorized, level-synchronous dirty evaluation.
+#
+# The dirty rule is a per-edge comparison (child newest > parent oldest, or child dirty),
+# so all edges can be compared at once.  Nodes are grouped by height above the leaves:
+#   height(leaf) = 0,  height(n) = 1 + max(height(children))
+# Every child of a level-L parent sits on a lower level, so by the time level L is
+# processed its children are final.  Each level is then one array operation.
+#
+# The levels and edge arrays are computed once per engine; mtimes are re-read on
+# every getDirty(), so the same engine can be re-evaluated after set_mtime().
+
+
+class LevelEngine:
+    def __init__(self, tree, root=None):
+        assert np is not None, "LevelEngine requires numpy"
+
+        # Accept a DepTree too; results are then mapped back to its nodes
+        self.nodes = None
+        if not isinstance(tree, CDepTree):
+            assert root is None
+            self.nodes = tree.topo_order()
+            tree = CDepTree.from_deptree(tree)
+        self.ctree = tree
+        self.root = tree.root if root is None else root
+
+        tree._build()
+        order = np.frombuffer(tree.postorder(self.root), dtype=np.int64).copy()
+        indptr = np.frombuffer(tree._indptr, dtype=np.int64).copy()
+        indices = np.frombuffer(tree._indices, dtype=np.int64).copy()
+        n = len(tree)
+
+        # Edges whose parent is reachable from root
+        reachable = np.zeros(n, dtype=bool)
+        reachable[order] = True
+        parents = np.repeat(np.arange(n, dtype=np.int64), np.diff(indptr))
+        keep = reachable[parents]
+        parents = parents[keep]
+        children = indices[keep]
+
+        # Heights, in one pass over the postorder (children are always done first)
+        height = np.zeros(n, dtype=np.int64)
+        hl = height.tolist()
+        ip = indptr.tolist()
+        ix = indices.tolist()
+        for v in order.tolist():
+            h = 0
+            for e in range(ip[v], ip[v + 1]):
+                if hl[ix[e]] + 1 > h:
+                    h = hl[ix[e]] + 1
+            hl[v] = h
+        height[:] = hl
+
+        # Edges sorted by their parent's level; bounds[L]:bounds[L+1] is level L
+        elevel = height[parents]
+        byLevel = np.argsort(elevel, kind='stable')
+        self.parents = parents[byLevel]
+        self.children = children[byLevel]
+        self.bounds = np.searchsorted(elevel[byLevel], np.arange(int(height.max(initial=0)) + 2))
+        self.order = order
+        self.n = n
+
+    def dirty_mask(self):
+        # Boolean array: dirty[i] for every node id
+        oldest = np.frombuffer(self.ctree.oldest, dtype=np.int64)
+        newest = np.frombuffer(self.ctree.newest, dtype=np.int64)
+        older = newest[self.children] > oldest[self.parents]
+        del oldest, newest  # release the buffers so the columns can still grow
+
+        dirty = np.zeros(self.n, dtype=bool)
+        b = self.bounds
+        for L in range(1, len(b) - 1):
+            lo, hi = b[L], b[L + 1]
+            if lo == hi:
+                continue
+            hit = older[lo:hi] | dirty[self.children[lo:hi]]
+            dirty[self.parents[lo:hi][hit]] = True
+        return dirty
+
+    def getDirty(self):
+        # Same nodes, in the same bottom-up order, as getDirty on the source tree
+        dirty = self.dirty_mask()
+        ids = self.order[dirty[self.order]].tolist()
+        if self.nodes is not None:
+            return [self.nodes[i] for i in ids]
+        return ids
+
+    def isDirty(self):
+        return bool(self.dirty_mask()[self.root])
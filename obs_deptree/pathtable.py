@@ -0,0 +1,32 @@
+import sys
+from pathlib import Path
+
+# Interned file paths.
+# Thousands of nodes share the same few directories (db/, src/<VID>/...), so instead of
+# each node holding its own Path, a node holds (directory id, basename):
+#   dirs[dirid]  one Path per distinct directory
+#   basename     an interned str
+# and rebuilds the Path on demand.
+
+
+class PathTable:
+    def __init__(self):
+        self.dirs = []
+        self._dirids = {}
+
+    def intern(self, path):
+        # Returns (dirid, basename) for the argued path
+        path = Path(path)
+        d = path.parent
+        dirid = self._dirids.get(d)
+        if dirid is None:
+            dirid = len(self.dirs)
+            self.dirs.append(d)
+            self._dirids[d] = dirid
+        return dirid, sys.intern(path.name)
+
+    def path(self, dirid, basename):
+        return self.dirs[dirid] / basename
+
+    def __len__(self):
+        return len(self.dirs)
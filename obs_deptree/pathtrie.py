@@ -0,0 +1,110 @@
+import re
+from fnmatch import translate
+
+from obs_deptree.registry import canonical, node_path
+
+# Path-component trie, mapping filesystem paths to the nodes that watch them.
+# Each level is one component of a canonical path:
+#   literal[name]   child trie for an exact component
+#   globs           [(pattern, compiled pattern, child trie)] for components like 'c*' or '[ab]?'
+#   doublestar      child trie for '**' (any number of directories, including none)
+#   nodes           nodes whose path ends here
+#   owners          nodes with a leaf glob ending here (see DepTree.leaf_globs)
+#
+# lookup(path) follows every literal and glob branch that matches, so a new file under
+# a glob leaf like src/[VID]/*.csv is found even if no node existed for it yet:
+# lookup(path, owners=True) returns the nodes it would be a child of.
+
+GLOBCHARS = '*?['
+
+
+def is_glob(part):
+    return any(ch in part for ch in GLOBCHARS)
+
+
+class PathTrie:
+    __slots__ = ('literal', 'globs', 'doublestar', 'anydepth', 'nodes', 'owners')
+
+    def __init__(self, anydepth=False):
+        self.literal = {}
+        self.globs = []
+        self.doublestar = None
+        self.anydepth = anydepth  # reached through '**': may swallow further components
+        self.nodes = []
+        self.owners = []
+
+    def insert(self, path, node, owner=False):
+        t = self
+        for part in canonical(path).parts:
+            if part == '**':
+                if t.doublestar is None:
+                    t.doublestar = PathTrie(anydepth=True)
+                t = t.doublestar
+            elif is_glob(part):
+                for pattern, match, sub in t.globs:
+                    if pattern == part:
+                        t = sub
+                        break
+                else:
+                    sub = PathTrie()
+                    t.globs.append((part, re.compile(translate(part)).match, sub))
+                    t = sub
+            else:
+                sub = t.literal.get(part)
+                if sub is None:
+                    sub = t.literal[part] = PathTrie()
+                t = sub
+        (t.owners if owner else t.nodes).append(node)
+
+    @staticmethod
+    def _closure(level):
+        # Add the '**' branches, which may match zero components
+        out = []
+        stack = list(level)
+        while stack:
+            t = stack.pop()
+            if t in out:
+                continue
+            out.append(t)
+            if t.doublestar is not None:
+                stack.append(t.doublestar)
+        return out
+
+    def lookup(self, path, owners=False):
+        # Every node whose path or pattern matches path; owners=True: every node with a
+        # leaf glob matching it instead
+        level = self._closure([self])
+        for part in canonical(path).parts:
+            nxt = []
+            for t in level:
+                sub = t.literal.get(part)
+                if sub is not None:
+                    nxt.append(sub)
+                for pattern, match, sub in t.globs:
+                    if match(part):
+                        nxt.append(sub)
+                if t.anydepth:
+                    nxt.append(t)  # still inside a '**'
+            if not nxt:
+                return []
+            level = self._closure(nxt)
+
+        found = []
+        seen = set()
+        for t in level:
+            for n in (t.owners if owners else t.nodes):
+                if n not in seen:
+                    seen.add(n)
+                    found.append(n)
+        return found
+
+    @staticmethod
+    def from_tree(root):
+        trie = PathTrie()
+        for n in root.topo_order():
+            p = node_path(n)
+            if p is not None:
+                trie.insert(p, n)
+            for pattern in n.leaf_globs():
+                trie.insert(pattern, n, owner=True)
+        return trie
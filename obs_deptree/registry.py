@@ -0,0 +1,67 @@
+import os
+from pathlib import Path
+
+# Hash-table index of the nodes of a tree, by name and by canonical file path.
+#   by_name[name]  -> [nodes]  (names needn't be unique)
+#   by_path[path]  -> [nodes]  (one node per path if the tree was built through the registry)
+#
+# from_dict_tree builds through a registry, so a file mentioned twice in a spec becomes
+# one shared node rather than two copies.  Every root can also produce one on demand:
+# DepTree.registry().
+
+
+def canonical(path):
+    # Absolute and normalized, without touching the filesystem (no symlink resolution)
+    return Path(os.path.abspath(path))
+
+
+def node_path(node):
+    # The path a node stands for: its file, or its glob pattern for glob nodes
+    globstr = getattr(node, 'globstr', None)
+    filepath = getattr(node, 'filepath', None)
+    if globstr is not None:
+        return Path(filepath or node.default_dir, globstr)
+    return filepath
+
+
+class NodeRegistry:
+    def __init__(self):
+        self.by_name = {}
+        self.by_path = {}
+
+    def __len__(self):
+        return sum(len(l) for l in self.by_name.values())
+
+    def register(self, node):
+        self.by_name.setdefault(node.name, []).append(node)
+        p = node_path(node)
+        if p is not None:
+            self.by_path.setdefault(canonical(p), []).append(node)
+        return node
+
+    def get_or_create(self, path, factory):
+        # The node already registered for path, else factory() registered under it
+        l = self.by_path.get(canonical(path))
+        if l:
+            return l[0]
+        return self.register(factory())
+
+    def find(self, name):
+        l = self.by_name.get(name)
+        return l[0] if l else None
+
+    def find_path(self, path):
+        l = self.by_path.get(canonical(path))
+        return l[0] if l else None
+
+    def find_all(self, name=None, path=None):
+        if path is not None:
+            return self.by_path.get(canonical(path), [])
+        return self.by_name.get(name, [])
+
+    @staticmethod
+    def from_tree(root):
+        r = NodeRegistry()
+        for n in root.topo_order():
+            r.register(n)
+        return r
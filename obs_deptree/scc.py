@@ -0,0 +1,85 @@
+# Strongly connected components of a dependency graph (Tarjan), iterative and linear
+# in nodes + edges.  Any component with more than one node, or a node depending on
+# itself, is a dependency cycle.
+#
+# Components come out children-first: every component follows all of the components
+# it depends on.  For an acyclic graph that is exactly DepTree.postorder().
+
+
+class CycleError(Exception):
+    def __init__(self, cycle):
+        self.cycle = cycle
+        names = [n.get_name() for n in cycle + cycle[:1]]
+        super().__init__('dependency cycle: %s' % ' -> '.join(names))
+
+
+def strongly_connected(root):
+    # root: a node, or a list of nodes whose graphs are analysed together
+    roots = root if isinstance(root, list) else [root]
+    index = {}    # node -> discovery order
+    low = {}      # node -> lowest index reachable
+    onstack = set()
+    stack = []
+    components = []
+
+    for root in roots:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        onstack.add(root)
+        work = [(root, iter(root.children))]
+        while work:
+            node, kids = work[-1]
+            for c in kids:
+                if c not in index:
+                    index[c] = low[c] = len(index)
+                    stack.append(c)
+                    onstack.add(c)
+                    work.append((c, iter(c.children)))
+                    break
+                elif c in onstack:
+                    low[node] = min(low[node], index[c])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        n = stack.pop()
+                        onstack.discard(n)
+                        component.append(n)
+                        if n is node:
+                            break
+                    component.reverse()
+                    components.append(component)
+    return components
+
+
+def is_cycle(component):
+    return len(component) > 1 or component[0] in component[0].children
+
+
+def find_cycle(component):
+    # One concrete cycle through component[0], staying inside the component
+    start = component[0]
+    members = set(component)
+    previous = {}
+    frontier = [start]
+    while frontier:
+        nxt = []
+        for n in frontier:
+            for c in n.children:
+                if c is start:
+                    cycle = [n]
+                    while cycle[-1] is not start:
+                        cycle.append(previous[cycle[-1]])
+                    cycle.reverse()
+                    return cycle
+                if c in members and c not in previous:
+                    previous[c] = n
+                    nxt.append(c)
+        frontier = nxt
+    return None
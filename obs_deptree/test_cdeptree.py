@@ -0,0 +1,59 @@
+from obs_deptree.deptree_base import DepTree
+from obs_deptree.cdeptree import CDepTree, MTIME_MAX
+
+# Same shape as DeepTree in test_deptree.py:  aab is shared by aa and c
+def deeptree():
+    aaa = DepTree(name='aaa')
+    aab = DepTree(name='aab')
+    aa = DepTree(children=[aaa, aab], name='aa')
+    ab = DepTree(name='ab')
+    a = DepTree(children=[aa, ab], name='a')
+    bb = DepTree(name='bb')
+    ba = DepTree(name='ba')
+    b = DepTree(children=[ba, bb], name='b')
+    c = DepTree(children=[aab], name='c')
+    root = DepTree(children=[a, b, c], name='root')
+    return root, aab
+
+def test_from_deptree_clean():
+    root, aab = deeptree()
+    t = CDepTree.from_deptree(root)
+    assert len(t) == 10
+    assert t.names[t.root] == 'root'
+    assert t.getDirty() == []
+    assert not t.isDirty()
+
+def test_from_deptree_dirty():
+    root, aab = deeptree()
+    aab._mtime = 5
+    t = CDepTree.from_deptree(root)
+    l = [t.names[i] for i in t.getDirty()]
+    assert l == [d.name for d in root.getDirty()]
+    assert t.isDirty()
+
+def test_walk():
+    root, aab = deeptree()
+    t = CDepTree.from_deptree(root)
+    visited = []
+    t.walk(visited.append)
+    assert len(visited) == 11  # aab twice, as in DepTree.walk
+    assert visited[-1] == t.root
+
+def test_from_dict_tree():
+    treeg = {'base': {'b1': ['cb1a', 'cb1b']
+                      , 'b2': 'cb2'}}
+    t = CDepTree.from_dict_tree(treeg)
+    assert t.names[t.root] == 'base'
+    assert [t.names[i] for i in t.postorder()] == ['cb1a', 'cb1b', 'b1', 'cb2', 'b2', 'base']
+    t.set_mtime(t.names.index('cb2'), 5)
+    assert [t.names[i] for i in t.getDirty()] == ['b2', 'base']
+
+def test_duplicate_edges_and_inf():
+    t = CDepTree()
+    r = t.add_node('root', mtime=float('inf'))
+    a = t.add_node('a', mtime=7)
+    t.add_child(r, a)
+    t.add_child(r, a)
+    assert list(t.children(r)) == [a]
+    assert t.oldest[r] == MTIME_MAX
+    assert t.getDirty() == []
@@ -100,3 +100,206 @@ def test_fromliteral():
     root.walk(make1dirty)
     l = root.getDirty()
     #print(l)
+
+def test_deeptree_getdirty_memo(deeptree):
+    deeptree.aab._mtime = 5
+    recursive = DeepTree()
+    recursive.aab._mtime = 5
+    l = deeptree.root.getDirty(memoize=True)
+    assert [d.name for d in l] == [d.name for d in recursive.root.getDirty()]
+    assert deeptree.root.isDirty(memoize=True)
+
+def test_memo_clean(deeptree):
+    assert deeptree.root.getDirty(memoize=True) == []
+    assert not deeptree.root.isDirty(memoize=True)
+
+class CountingTree(DepTree):
+    compared = 0
+    def is_older_than(self, otherDepTree):
+        CountingTree.compared += 1
+        return super().is_older_than(otherDepTree)
+
+def test_memo_diamonds():
+    # 20 stacked diamonds: 2**20 paths, but only 60 edges
+    bottom = CountingTree(name='bottom', mtime=5)
+    top = bottom
+    for i in range(20):
+        l = CountingTree(children=top, name='l%d' % i)
+        r = CountingTree(children=top, name='r%d' % i)
+        top = CountingTree(children=[l, r], name='top%d' % i)
+    CountingTree.compared = 0
+    l = top.getDirty(memoize=True)
+    assert CountingTree.compared <= 60
+    assert len(l) == 60
+    assert l[-1] is top
+
+def test_memo_deep_chain():
+    node = DepTree(name='leaf', mtime=5)
+    for i in range(5000):
+        node = DepTree(children=node, name=str(i))
+    assert len(node.postorder()) == 5001
+    assert len(node.getDirty(memoize=True)) == 5000
+
+def test_topo_order_cached(deeptree):
+    r = deeptree.root
+    order = r.topo_order()
+    assert [n.name for n in order] == ['aaa', 'aab', 'aa', 'ab', 'a', 'ba', 'bb', 'b', 'c', 'root']
+    assert r.topo_order() is order
+    assert r.topo_index()[r] == 9
+
+    d = DepTree(name='d', mtime=5)
+    r.children[2].add_child(d)
+    order = r.topo_order()
+    assert [n.name for n in order][-3:] == ['d', 'c', 'root']
+    assert [n.name for n in r.getDirty(memoize=True)] == ['c', 'root']
+
+def test_parents(deeptree):
+    aab = deeptree.aab
+    assert sorted(p.name for p in aab.parents) == ['aa', 'c']
+    assert deeptree.root.parents == []
+
+def test_mark_changed(deeptree):
+    r = deeptree.root
+    assert r.getDirty() == []
+    l = deeptree.aab.mark_changed(5)
+    assert sorted(n.name for n in l) == ['a', 'aa', 'c', 'root']
+    assert r.knownDirty
+    # b's subtree was never touched
+    assert not r.children[1].knownDirty
+    assert deeptree.aab.mark_changed(6) == []
+
+def test_invalidate_node(deeptree):
+    l = deeptree.root.invalidate(deeptree.aab, mtime=5)
+    assert len(l) == 4
+
+def test_find(deeptree):
+    r = deeptree.root
+    assert r.find('aab') is deeptree.aab
+    assert r.find('nothere') is None
+    assert len(r.registry()) == 10
+    assert repr(DepTree()).startswith('<DepTree ')
+
+def test_aggregates(deeptree):
+    r = deeptree.root
+    r.build_aggregates()
+    assert not r.is_stale()
+    assert r.newest_input() == 0
+
+    deeptree.aab.mark_changed(5)
+    assert r.is_stale()
+    assert r.newest_input() == 5
+    assert r.children[2].is_stale()          # c
+    assert not r.children[1].is_stale()      # b
+
+    # outputs rebuilt: clean again
+    for n in r.topo_order():
+        if n.children:
+            n.mark_changed(6)
+    assert not r.is_stale()
+    assert not r._provably_clean()  # mark_changed(5) flagged the targets knownDirty
+    r.reset()
+    assert r._provably_clean()
+
+    d = DepTree(name='d', mtime=7)
+    r.children[1].add_child(d)
+    assert r.is_stale()
+    assert r.newest_input() == 7
+
+def test_aggregates_prune():
+    bottom = CountingTree(name='bottom', mtime=1)
+    mid = CountingTree(children=bottom, name='mid', mtime=2)
+    top = CountingTree(children=mid, name='top', mtime=3)
+    top.build_aggregates()
+    CountingTree.compared = 0
+    assert not top.isDirty()
+    assert top.getDirty(memoize=True) == []
+    assert CountingTree.compared == 0
+
+def test_aggregates_prune_flagged():
+    # A flagged node still dirties its parent, as without aggregates
+    def chain():
+        bottom = DepTree(name='bottom', mtime=1)
+        mid = DepTree(children=bottom, name='mid', mtime=2)
+        return mid, DepTree(children=mid, name='top', mtime=3)
+    mid, top = chain()
+    mid.knownDirty = True
+    assert top.getDirty() == [top]
+
+    for evaluate in [lambda t: t.isDirty(), lambda t: t.getDirty(memoize=True) == [t]]:
+        mid, top = chain()
+        top.build_aggregates()
+        mid.knownDirty = True
+        assert not top._provably_clean()
+        assert evaluate(top)
+        top.reset()
+        assert top._provably_clean()
+        assert not top.isDirty()
+
+def test_changed_since(deeptree):
+    r = deeptree.root
+    for n in r.topo_order():
+        n._mtime = 10
+    deeptree.aab.mark_changed(20)
+    r.find('bb').mark_changed(15)
+
+    leaves, targets = r.changed_since(10)
+    assert [n.name for n in leaves] == ['bb', 'aab']
+    assert [n.name for n in targets] == ['aa', 'a', 'b', 'c', 'root']
+
+    leaves, targets = r.changed_since(15)
+    assert [n.name for n in leaves] == ['aab']
+    assert [n.name for n in targets] == ['aa', 'a', 'c', 'root']
+    assert r.changed_since(20) == ([], [])
+
+def test_components_acyclic(deeptree):
+    r = deeptree.root
+    assert [u[0] for u in r.components()] == r.topo_order()
+    assert r.find_cycles() == []
+    assert r.finalize() is r
+
+def cyclic():
+    a = DepTree(name='a')
+    b = DepTree(children=a, name='b')
+    c = DepTree(children=b, name='c')
+    a.add_child(c)
+    leaf = DepTree(name='leaf')
+    a.add_child(leaf)
+    root = DepTree(children=a, name='root')
+    return root, leaf
+
+def test_cycle_detected():
+    root, leaf = cyclic()
+    cycles = root.find_cycles()
+    assert len(cycles) == 1
+    assert sorted(n.name for n in cycles[0]) == ['a', 'b', 'c']
+    with pytest.raises(CycleError) as e:
+        root.finalize()
+    assert e.value.cycle == cycles[0]
+    assert '->' in str(e.value)
+
+def test_cycle_condensed():
+    root, leaf = cyclic()
+    root.finalize(condense=True)
+    assert root.getDirty(memoize=True) == []
+    leaf._mtime = 5
+    l = root.getDirty(memoize=True)
+    assert sorted(n.name for n in l[:3]) == ['a', 'b', 'c']
+    assert l[3] is root
+
+def test_cycle_condensed_mtimes():
+    # Members' mtimes differ, so within the cycle one is always older than the other
+    a = DepTree(name='a', mtime=1)
+    b = DepTree(children=a, name='b', mtime=2)
+    a.add_child(b)
+    root = DepTree(children=a, name='root', mtime=3)
+    root.finalize(condense=True)
+    assert root.getDirty(memoize=True) == []
+    leaf = DepTree(name='leaf', mtime=4)
+    b.add_child(leaf)
+    assert len(root.getDirty(memoize=True)) == 3
+
+def test_deep_chain_scc():
+    node = DepTree(name='leaf')
+    for i in range(5000):
+        node = DepTree(children=node, name=str(i))
+    assert len(node.components()) == 5001
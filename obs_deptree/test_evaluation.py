@@ -0,0 +1,117 @@
+from concurrent.futures import ThreadPoolExecutor
+from obs_deptree.deptree_base import DepTree
+from obs_deptree.evaluation import EvalContext, prepare, evaluate_forest
+
+
+def chain_tree():
+    # root <- a <- (a1, a2);  root <- b <- b1
+    a1 = DepTree(name='a1')
+    a2 = DepTree(name='a2')
+    a = DepTree(children=[a1, a2], name='a')
+    b1 = DepTree(name='b1')
+    b = DepTree(children=b1, name='b')
+    root = DepTree(children=[a, b], name='root')
+    return root, a, a2, b1
+
+def test_context_leaves_nodes_alone():
+    root, a, a2, b1 = chain_tree()
+    a2._mtime = 5
+    ctx = EvalContext(root)
+    assert [n.name for n in ctx.getDirty()] == ['a', 'root']
+    assert ctx.isDirty()
+    assert ctx.isDirty(a)
+    assert not ctx.isDirty(b1)
+    assert not any(n.knownDirty for n in root.topo_order())
+
+def test_reevaluate():
+    root, a, a2, b1 = chain_tree()
+    a2._mtime = 5
+    assert root.getDirty(memoize=True)
+    # outputs rebuilt
+    a._mtime = root._mtime = 6
+    assert EvalContext(root).getDirty() == []
+    # sticky flags from the first evaluation are still set until reset()
+    assert root.getDirty(memoize=True)
+    root.reset()
+    assert root.getDirty(memoize=True) == []
+
+def test_concurrent_contexts():
+    root, a, a2, b1 = chain_tree()
+    prepare(root)
+
+    def evaluate(target):
+        return [n.name for n in EvalContext(target).getDirty()]
+
+    a2._mtime = 5
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(evaluate, [root, a] * 50))
+    assert results[0::2] == [['a', 'root']] * 50
+    assert results[1::2] == [['a']] * 50
+
+def test_iterdirty_order():
+    root, a, a2, b1 = chain_tree()
+    a2._mtime = 5
+    b1._mtime = 5
+    it = root.iterDirty()
+    assert next(it) is a
+    assert [n.name for n in it] == ['b', 'root']
+
+class StatTree(DepTree):
+    # refresh_mtime() reads from a dict standing in for the filesystem, and logs
+    fs = {}
+    log = []
+    def refresh_mtime(self):
+        StatTree.log.append('stat ' + self.name)
+        self._mtime = StatTree.fs.get(self.name, 0)
+
+def test_iterdirty_restat_streams():
+    leaves = [StatTree(name='l%d' % i) for i in range(3)]
+    mids = [StatTree(children=l, name='m%d' % i) for i, l in enumerate(leaves)]
+    root = StatTree(children=mids, name='root')
+    StatTree.fs = {'l0': 5, 'm1': 1, 'l2': 5}
+    StatTree.log = []
+    for n in root.iterDirty(restat=True):
+        StatTree.log.append('dirty ' + n.name)
+    # m0 is reported before l1 is even stat'ed
+    assert StatTree.log.index('dirty m0') < StatTree.log.index('stat l1')
+    assert [e for e in StatTree.log if e.startswith('dirty')] == ['dirty m0', 'dirty m2', 'dirty root']
+
+class CountingTree(DepTree):
+    compared = 0
+    def is_older_than(self, otherDepTree):
+        CountingTree.compared += 1
+        return super().is_older_than(otherDepTree)
+
+def test_forest():
+    # cdb-N and tdb-N both depend on db-N, which depends on csv-N
+    csvs = [CountingTree(name='csv%d' % i) for i in range(4)]
+    dbs = [CountingTree(children=c, name='db%d' % i) for i, c in enumerate(csvs)]
+    cdbs = [CountingTree(children=d, name='cdb%d' % i) for i, d in enumerate(dbs)]
+    tdbs = [CountingTree(children=[d, CountingTree(name='trips')], name='tdb%d' % i)
+            for i, d in enumerate(dbs)]
+    allc = CountingTree(children=cdbs, name='ALLCDBs')
+    allt = CountingTree(children=tdbs, name='ALLTDBs')
+    csvs[1]._mtime = 5
+
+    CountingTree.compared = 0
+    results = evaluate_forest([allc, allt])
+    assert CountingTree.compared <= 4 + 4 + 8 + 4 + 4  # each edge at most once
+    assert [n.name for n in results[allc]] == ['db1', 'cdb1', 'ALLCDBs']
+    assert [n.name for n in results[allt]] == ['db1', 'tdb1', 'ALLTDBs']
+    assert results[allc] == allc.getDirty(memoize=True)
+
+    ctx = EvalContext([allc, allt])
+    assert [n.name for n in ctx.getDirty(cdbs[1])] == ['db1', 'cdb1']
+    assert ctx.isDirty(allt)
+    assert not ctx.isDirty(cdbs[0])
+
+def test_prepare_survives_other_trees():
+    root, a, a2, b1 = chain_tree()
+    prepare(root)
+    order = root.topo_order()
+    other, *rest = chain_tree()
+    other.add_child(DepTree(name='new'))
+    assert root.topo_order() is order
+    b1.add_child(DepTree(name='below'))
+    assert root.topo_order() is not order
+    assert len(root.topo_order()) == len(order) + 1
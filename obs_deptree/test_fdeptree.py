@@ -79,3 +79,79 @@ def test_update(sessiondir,threedeep):
     mt2 = MedTree(sessiondir)
     dirty = mt2.root.isDirty()
     assert not dirty
+
+def test_invalidate_path(sessiondir):
+    mt = MedTree(sessiondir)
+    assert mt.root.getDirty() == []
+
+    time.sleep(0.005) # required to guarantee an mtime_ns difference
+    c1p = Path(sessiondir,'c1')
+    c1p.touch()
+    l = mt.root.invalidate(c1p)
+    assert [n.name for n in l] == ['b1', 'root']
+    assert mt.root.isDirty()
+
+def test_leaf_globs(sessiondir):
+    # A file matching an expanded leaf glob is still known after the expansion
+    import os
+    from obs_deptree.gfdeptree import GFDepTree
+    Path(sessiondir,'src','V1').mkdir(parents=True)
+    Path(sessiondir,'src','V1','a.csv').touch()
+    Path(sessiondir,'out').touch()
+    spec = {'root': {'out': 'src/*/*.csv'}}
+    new = Path(sessiondir,'src','V2','new.csv')
+    for cls in [FDepTree, GFDepTree]:
+        root = cls.from_dict_tree(spec, filedir=sessiondir)
+        out = root.find('out')
+        assert len(out.children) == 1
+        assert root.affected_targets([new]) == [out, root]
+        assert root.affected_targets([Path(sessiondir,'src','new.csv')]) == []
+
+        new.parent.mkdir(exist_ok=True)
+        new.touch()
+        later = Path(sessiondir,'out').stat().st_mtime_ns + 10**9
+        os.utime(new, ns=(later, later))
+        assert root.invalidate(new) == [out, root]
+        assert root.find_path(new) in out.children
+        shutil.rmtree(new.parent)
+
+def test_registry_dedup(sessiondir):
+    shared = {'root': [{'b1': 'c*'}, {'b2': 'c1'}]}
+    root = FDepTree.from_dict_tree(shared, filedir=sessiondir)
+    b1, b2 = root.children
+    assert b2.children[0] in b1.children
+    c1 = root.find_path(Path(sessiondir, 'c1'))
+    assert c1 is b2.children[0]
+    assert root.find('b2') is b2
+    assert len(root.registry().find_all(path=Path(sessiondir, 'c1'))) == 1
+    assert repr(root).startswith('<FDepTree ')
+
+def test_cycle_from_spec(sessiondir):
+    from obs_deptree.scc import CycleError
+    loop = {'root': {'b1': {'b2': {'b1': None}}}}
+    with pytest.raises(CycleError):
+        FDepTree.from_dict_tree(loop, filedir=sessiondir)
+
+def test_lazy(sessiondir):
+    root = FDepTree.from_dict_tree(med_tree_literal, filedir=sessiondir, lazy=True)
+    assert not root.is_expanded()
+    assert root.getDirty() == []
+    b1 = root.find('b1')
+    assert b1.is_expanded()
+    assert len(b1.children) == 2
+
+def test_lazy_target(sessiondir):
+    spec = {'root': [{'b1': 'c*'}, {'b2': {'x1': 'nothere*'}}]}
+    time.sleep(0.005) # required to guarantee an mtime_ns difference
+    Path(sessiondir,'c1').touch()
+    b1 = FDepTree.lazy_target(spec, 'b1', filedir=sessiondir)
+    assert b1.isDirty()
+    # only b1's subgraph was ever created
+    assert sorted(b1.registry().by_name) == ['b1', 'c1', 'c2']
+
+def test_stdlib_only_imports():
+    # obs_deptree uses dataproc's filesystem modules, not the app (configargparse, appdirs)
+    import subprocess, sys
+    code = ('import sys, obs_deptree.gfdeptree, obs_deptree.watch; '
+            'assert "dataproc.papp" not in sys.modules and "appdirs" not in sys.modules')
+    subprocess.run([sys.executable, '-c', code], check=True)
@@ -79,3 +79,144 @@ def test_update(sessiondir,threedeep):
     mt2 = MedTree(sessiondir)
     dirty = mt2.root.isDirty()
     assert not dirty
+
+def test_globnode(sessiondir):
+    g = GFDepTree(filepath=sessiondir, globstr='c*')
+    assert g.name == 'c*'
+    c1 = Path(sessiondir,'c1').stat().st_mtime_ns
+    c2 = Path(sessiondir,'c2').stat().st_mtime_ns
+    assert g._min_mtime == min(c1, c2)
+    assert g._max_mtime == max(c1, c2)
+
+    time.sleep(0.005) # required to guarantee an mtime_ns difference
+    Path(sessiondir,'c2').touch()
+    b1 = GFDepTree(children=g, filepath=Path(sessiondir,'b1'))
+    assert not b1.isDirty()
+    assert [n.name for n in b1.invalidate(g)] == ['b1']
+
+def test_expand_leaves(sessiondir):
+    root = GFDepTree.from_dict_tree(med_tree_literal, filedir=sessiondir)
+    assert len(root.children[0].children) == 2
+
+def test_slots(sessiondir):
+    n = GFDepTree(filepath=Path(sessiondir,'b1'))
+    assert not hasattr(n, '__dict__')
+    m = GFDepTree(filepath=Path(sessiondir,'b2'))
+    assert n._dirid == m._dirid
+    assert m.filepath == Path(sessiondir,'b2')
+
+def test_changed_since(sessiondir):
+    root = GFDepTree.from_dict_tree(med_tree_literal, filedir=sessiondir, expand_leaves=False)
+    glob = root.children[0].children[0]
+    t = glob._max_mtime
+    assert root.changed_since(t) == ([], [])
+
+    time.sleep(0.005) # required to guarantee an mtime_ns difference
+    Path(sessiondir,'c2').touch()
+    glob.mark_changed()
+    leaves, targets = root.changed_since(t)
+    assert leaves == [glob]
+    assert [n.name for n in targets] == ['b1', 'root']
+
+def test_affected_targets(sessiondir):
+    root = GFDepTree.from_dict_tree(med_tree_literal, filedir=sessiondir, expand_leaves=False)
+    l = root.affected_targets([Path(sessiondir,'c9'), Path(sessiondir,'unrelated')])
+    assert [n.name for n in l] == ['b1', 'root']
+    assert root.affected_targets([Path(sessiondir,'b2')]) == [root]
+    assert root.affected_targets([Path('/elsewhere/c1')]) == []
+
+def test_lazy_globs(sessiondir):
+    root = GFDepTree.from_dict_tree(med_tree_literal, filedir=sessiondir,
+                                    expand_leaves=False, lazy=True)
+    b1 = root.children[0]
+    glob = b1.children[0]
+    assert glob._deferred
+    assert not root.isDirty()
+    assert not glob._deferred
+
+    time.sleep(0.005) # required to guarantee an mtime_ns difference
+    Path(sessiondir,'c2').touch()
+    b1 = GFDepTree.lazy_target(med_tree_literal, 'b1', filedir=sessiondir, expand_leaves=False)
+    assert b1.isDirty()
+
+def test_recursive_globnode(sessiondir):
+    Path(sessiondir, 'sub', 'deeper').mkdir(parents=True)
+    time.sleep(0.005) # required to guarantee an mtime_ns difference
+    Path(sessiondir, 'sub', 'deeper', 'c3').touch()
+    g = GFDepTree(filepath=sessiondir, globstr='**/c*')
+    assert g._min_mtime == Path(sessiondir,'c1').stat().st_mtime_ns
+    assert g._max_mtime == Path(sessiondir,'sub','deeper','c3').stat().st_mtime_ns
+
+def test_parallel_from_tree(sessiondir):
+    from dataproc.parallel import io_concurrency
+    from dataproc.snapshot import snapshot_for
+    serial = GFDepTree.from_dict_tree(med_tree_literal, filedir=sessiondir)
+    with io_concurrency(4):
+        root = GFDepTree.from_dict_tree(med_tree_literal, filedir=sessiondir)
+        assert snapshot_for(sessiondir) is None  # only open while building
+    assert [n._mtime for n in root.postorder()] == [n._mtime for n in serial.postorder()]
+
+def test_deferred_globnode(sessiondir):
+    import os
+    Path(sessiondir,'out').touch()
+    Path(sessiondir,'newer').touch()
+    later = Path(sessiondir,'out').stat().st_mtime_ns + 10**9
+    os.utime(Path(sessiondir,'newer'), ns=(later, later))
+    spec = {'out': [{'newer': None}, 'c*']}
+    for evaluate in [lambda root: root.isDirty(), lambda root: root.getDirty(),
+                     lambda root: root.getDirty(memoize=True)]:
+        root = GFDepTree.from_dict_tree(spec, filedir=sessiondir, expand_leaves=False)
+        glob = root.children[1]
+        assert glob.globstr == 'c*' and not glob.is_expanded()
+        assert evaluate(root)
+        assert not glob.is_expanded()  # out was already dirty through newer
+
+    c1 = Path(sessiondir,'c1').stat().st_mtime_ns
+    assert glob._min_mtime == c1 and glob.is_expanded()
+
+def test_aggregates(threedeep):
+    r = threedeep
+    b1, b2 = r.children
+    glob = b1.children[0]
+    t = glob._max_mtime
+    for n in [b2, b1, r]:
+        n.mark_changed(t)
+    r.build_aggregates()
+    assert not r.is_stale()
+
+    glob.mark_changed(t + 5)  # a new c file
+    assert r.is_stale() and b1.is_stale()
+    assert not b2.is_stale()
+
+    # outputs rebuilt: clean again
+    for n in r.topo_order():
+        if n.children:
+            n.mark_changed(t + 6)
+    assert b1._min_mtime == b1._max_mtime == t + 6
+    assert not r.is_stale()
+
+def test_expand_threads(sessiondir, monkeypatch):
+    # A glob being expanded by one thread still looks pending to the others
+    import threading
+    from obs_deptree.evaluation import prepare
+    g = GFDepTree(filepath=sessiondir, globstr='c*')
+    real = GFDepTree.get_glob_mtimes
+    started, go = threading.Event(), threading.Event()
+    def slow(self, *args):
+        started.set()
+        go.wait()
+        return real(self, *args)
+    monkeypatch.setattr(GFDepTree, 'get_glob_mtimes', slow)
+    t = threading.Thread(target=lambda: g._max_mtime)
+    t.start()
+    started.wait()
+    assert not g.is_expanded()
+    go.set()
+    t.join()
+    assert g._max_mtime == max(Path(sessiondir, c).stat().st_mtime_ns for c in ['c1', 'c2'])
+
+    monkeypatch.undo()
+    root = GFDepTree.from_dict_tree({'out': 'c*'}, filedir=sessiondir, expand_leaves=False)
+    assert not root.children[0].is_expanded()
+    prepare(root)
+    assert root.children[0].is_expanded()
@@ -0,0 +1,48 @@
+import random
+import pytest
+from obs_deptree.deptree_base import DepTree
+from obs_deptree.cdeptree import CDepTree
+
+np = pytest.importorskip('numpy')
+from obs_deptree.levels import LevelEngine
+
+
+def test_deptree_input():
+    aaa = DepTree(name='aaa')
+    aab = DepTree(name='aab', mtime=5)
+    aa = DepTree(children=[aaa, aab], name='aa')
+    a = DepTree(children=[aa, DepTree(name='ab')], name='a')
+    c = DepTree(children=[aab], name='c')
+    root = DepTree(children=[a, c], name='root')
+    e = LevelEngine(root)
+    assert e.getDirty() == root.getDirty(memoize=True)
+    assert e.isDirty()
+
+def test_matches_getdirty_random():
+    rng = random.Random(4)
+    t = CDepTree()
+    for i in range(2000):
+        t.add_node(str(i), mtime=rng.randrange(100))
+    # edges only to higher ids: a DAG rooted at 0
+    for i in range(1, 2000):
+        t.add_child(rng.randrange(i), i)
+        if i > 2:
+            t.add_child(rng.randrange(i), i)
+    t.root = 0
+    e = LevelEngine(t)
+    assert e.getDirty() == t.getDirty()
+
+    # re-evaluate after mtimes change, without rebuilding levels
+    for i in range(2000):
+        t.set_mtime(i, 50)
+    assert e.getDirty() == t.getDirty() == []
+    t.set_mtime(1999, 51)
+    assert e.getDirty() == t.getDirty()
+    assert e.isDirty()
+
+def test_single_node():
+    t = CDepTree()
+    t.add_node('only')
+    e = LevelEngine(t)
+    assert e.getDirty() == []
+    assert not e.isDirty()
@@ -0,0 +1,27 @@
+from pathlib import Path
+from obs_deptree.pathtrie import PathTrie
+
+
+def test_literal_and_glob():
+    t = PathTrie()
+    t.insert('/base/db/final.db', 'final')
+    t.insert('/base/src/[ab]*/*.csv', 'csvs')
+    t.insert('/base/src/a1/x.csv', 'x')
+    assert t.lookup('/base/db/final.db') == ['final']
+    assert sorted(t.lookup(Path('/base/src/a1/x.csv'))) == ['csvs', 'x']
+    assert t.lookup('/base/src/b7/new.csv') == ['csvs']
+    assert t.lookup('/base/src/c1/new.csv') == []
+    assert t.lookup('/base/src/a1/x.txt') == []
+    assert t.lookup('/base/db') == []
+
+def test_doublestar():
+    t = PathTrie()
+    t.insert('/base/src/**/*.csv', 'deep')
+    assert t.lookup('/base/src/x.csv') == ['deep']
+    assert t.lookup('/base/src/a/b/c/x.csv') == ['deep']
+    assert t.lookup('/base/other/x.csv') == []
+
+def test_canonical():
+    t = PathTrie()
+    t.insert('/base/db/../db/final.db', 'final')
+    assert t.lookup('/base/db/./final.db') == ['final']
@@ -0,0 +1,118 @@
+import os
+import shutil
+import time
+from pathlib import Path
+
+import pytest
+from dataproc import inotify
+from dataproc.inotify import IN_Q_OVERFLOW
+from obs_deptree.gfdeptree import GFDepTree
+from obs_deptree.watch import TreeWatcher
+
+pytestmark = pytest.mark.skipif(not inotify.available(), reason='needs Linux inotify')
+
+T = 1600000000 * 10**9
+
+def settime(path, t):
+    os.utime(path, ns=(t, t))
+
+@pytest.fixture
+def watchdir(request):
+    # This uses a hard directory instead of a proper temp file, in order to allow
+    # investigation on failure.
+    hd = Path('/tmp/test_watch/')
+    shutil.rmtree(hd,ignore_errors=True) # Cleanup before starting
+    hd.mkdir()
+    for f in ['c1','c2','b1','b2','root']:
+        Path(hd,f).touch()
+        settime(Path(hd,f), T)
+    return hd
+
+tree = {'root': [{'b1': 'c*'}, {'b2': None}]}
+
+def wait(w, want):
+    # poll until something comes out (events can take a moment)
+    for i in range(20):
+        got = w.poll(timeout=0.5)
+        if got or not want:
+            return got
+    return []
+
+def test_file_events(watchdir):
+    root = GFDepTree.from_dict_tree(tree, filedir=watchdir, expand_leaves=False)
+    assert root.getDirty() == []
+    with TreeWatcher(root, debounce=0.05) as w:
+        assert w.watched() == [str(watchdir)]
+        settime(Path(watchdir,'c2'), T + 10**9)
+        Path(watchdir,'c3').touch()  # a new file under the glob: coalesced with c2
+        assert [n.name for n in wait(w, True)] == ['b1', 'root']
+
+        # b1 rebuilt: clean again; root was already dirty
+        settime(Path(watchdir,'b1'), time.time_ns() + 10**10)
+        assert wait(w, False) == []
+        assert not root.children[0].knownDirty
+        assert root.knownDirty
+
+def test_new_directories(watchdir):
+    root = GFDepTree.from_dict_tree({'out': 'sub/*/*.csv'}, filedir=watchdir, expand_leaves=False)
+    Path(watchdir, 'out').touch()
+    root.getDirty()
+    with TreeWatcher(root, debounce=0.05) as w:
+        Path(watchdir, 'sub', 'a').mkdir(parents=True)
+        Path(watchdir, 'sub', 'a', 'x.csv').touch()
+        settime(Path(watchdir, 'sub', 'a', 'x.csv'), T * 2)
+        assert [n.name for n in wait(w, True)] == ['out']
+        assert str(Path(watchdir, 'sub', 'a')) in w.watched()
+
+def test_glob_output_rebuilt(watchdir):
+    # Every file of a glob output rewritten, the oldest too: clean again
+    for f in ['o1', 'o2']:
+        Path(watchdir, f).touch()
+        settime(Path(watchdir, f), T)
+    settime(Path(watchdir, 'b2'), T + 10**9)
+    out = GFDepTree(children=GFDepTree(filepath=Path(watchdir, 'b2')),
+                    filepath=watchdir, globstr='o*')
+    root = GFDepTree(children=out)
+    assert root.getDirty() == [out, root]
+    with TreeWatcher(root, debounce=0.05) as w:
+        settime(Path(watchdir, 'o2'), T + 2 * 10**9)
+        assert wait(w, False) == []
+        assert out.knownDirty  # o1 is still older than b2
+        settime(Path(watchdir, 'o1'), T + 2 * 10**9)
+        assert wait(w, False) == []
+        assert out._min_mtime == T + 2 * 10**9
+        assert not out.knownDirty
+
+def test_leaf_globs(watchdir):
+    # A new file under an expanded leaf glob, in a new directory: a new input of out
+    Path(watchdir, 'src', 'V1').mkdir(parents=True)
+    Path(watchdir, 'src', 'V1', 'a.csv').touch()
+    settime(Path(watchdir, 'src', 'V1', 'a.csv'), T)
+    Path(watchdir, 'out').touch()
+    root = GFDepTree.from_dict_tree({'out': 'src/*/*.csv'}, filedir=watchdir)
+    assert root.getDirty() == []
+    with TreeWatcher(root, debounce=0.05) as w:
+        Path(watchdir, 'src', 'V2').mkdir()
+        Path(watchdir, 'src', 'V2', 'new.csv').touch()
+        settime(Path(watchdir, 'src', 'V2', 'new.csv'), time.time_ns() + 10**10)
+        assert [n.name for n in wait(w, True)] == ['out']
+        assert len(root.children) == 2
+
+def test_overflow_rescan(watchdir):
+    root = GFDepTree.from_dict_tree(tree, filedir=watchdir, expand_leaves=False)
+    root.getDirty()
+    with TreeWatcher(root) as w:
+        settime(Path(watchdir,'b2'), T + 10**9)
+        got = w.apply([(-1, IN_Q_OVERFLOW, '')])  # as if the kernel had dropped the events
+        assert [n.name for n in got] == ['root'] and w.overflows == 1
+
+def test_watch_pspecs(watchdir):
+    import dataproc.papp, dataproc.processor
+    papp = dataproc.papp.Papp(basedir=watchdir)
+    ps = dataproc.processor.Pspec('c*', papp=papp)
+    root = GFDepTree.from_dict_tree(tree, filedir=watchdir, expand_leaves=False)
+    with TreeWatcher(root, pspecs=[ps], debounce=0.05) as w:
+        Path(watchdir,'c9').touch()
+        assert ps in wait(w, True)
+        assert not ps.evaluated
+        assert ps.newer_than(T)
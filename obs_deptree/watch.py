@@ -0,0 +1,285 @@
+import os
+import time
+from pathlib import Path
+
+from dataproc.globcache import listdir
+from dataproc.inotify import (Inotify, IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_IGNORED,
+                              IN_ISDIR, IN_MOVE_SELF, IN_MOVED_FROM, IN_MOVED_TO,
+                              IN_Q_OVERFLOW)
+from dataproc.scan import has_magic, stat_or_none
+from obs_deptree.gfdeptree import GFDepTree
+from obs_deptree.pathtrie import PathTrie
+from obs_deptree.registry import canonical, node_path
+
+# Watch mode: keeps a tree's mtimes and dirty flags current from inotify events, instead
+# of re-running getDirty over the whole tree every few minutes.
+#
+#   root.getDirty()                  # so the dirty flags start out current
+#   w = TreeWatcher(root, pspecs=[...])
+#   while True:
+#       for target in w.poll():      # blocks until something changes
+#           ...rebuild target...
+#
+# Only the directories the tree can see are watched: the directory of each file node,
+# every directory a glob node's or a leaf glob's pattern can match in (all of them below
+# a '**'), and
+# the directories on the way down to ones that don't exist yet, so they are picked up
+# when they are created.  Pspecs are watched the same way.
+#
+# poll() waits for events, then keeps reading until none has come for `debounce` seconds
+# (or `max_delay` has passed), coalescing them to one change per path.  Each changed path
+# goes to the nodes whose file or glob covers it (DepTree.watchers):
+#   - a file node is re-stat'ed;
+#   - a new file matching a leaf glob (from_dict_tree's default expand_leaves) becomes a
+#     new child of the node the glob was expanded into (DepTree.add_leaf);
+#   - a glob node takes a newly created file's mtime as a possible new oldest or newest
+#     (one stat); a file that was modified, replaced or went away could have been its
+#     oldest or newest, so then it re-globs (listings through the glob cache);
+#   - the node's own dirty flag is re-evaluated against its children (an output that
+#     was rebuilt is clean again), and the ancestors it dirties are marked.
+# It returns the targets that became dirty, bottom-up per root, followed by the Pspecs
+# whose files changed (these are only marked unevaluated: their next comparison rescans).
+#
+# If the kernel queue overflows, events were lost: the watches are re-synced and every
+# watched node is restat'ed (rescan()) -- globs through the glob cache, so unchanged
+# directories aren't listed again -- rather than walking the filesystem.
+
+
+class TreeWatcher:
+    def __init__(self, roots, pspecs=(), debounce=0.1, max_delay=1.0):
+        self.roots = roots if isinstance(roots, list) else [roots]
+        self.pspecs = list(pspecs)
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.overflows = 0
+        self.inotify = Inotify()
+        self._wds = {}       # wd -> directory
+        self._watched = {}   # directory -> wd
+        self._dirs = PathTrie()     # directory patterns to watch, with their prefixes
+        self._pspecs = PathTrie()   # file patterns -> Pspecs
+        self._starts = set()        # existing directories the patterns hang from
+
+        for root in self.roots:
+            for n in root.topo_order():
+                p = node_path(n)
+                if p is not None:
+                    self._want(canonical(p).parent)
+                for pattern in n.leaf_globs():
+                    self._want(canonical(pattern).parent)
+        for ps in self.pspecs:
+            for spec in ps.specs:
+                p = canonical(Path(ps.dir, spec))
+                self._pspecs.insert(p, ps)
+                self._want(p.parent)
+        self.sync_watches()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.inotify.close()
+
+    def watched(self):
+        return sorted(self._watched)
+
+    ####################################################################################
+    # Watches
+
+    def _want(self, pattern):
+        # Watch every directory matching pattern; until they exist, the deepest existing
+        # directory above them (and everything between, as it appears)
+        start = Path(pattern.anchor)
+        for part in pattern.parts[1:]:
+            if has_magic(part) or not Path(start, part).is_dir():
+                break
+            start = Path(start, part)
+        self._starts.add(str(start))
+        depth = len(start.parts)
+        self._dirs.insert(start, True)
+        for i in range(depth + 1, len(pattern.parts) + 1):
+            self._dirs.insert(Path(*pattern.parts[:i]), True)
+
+    def _wanted(self, d):
+        return bool(self._dirs.lookup(d))
+
+    def sync_watches(self, top=None):
+        # Adds a watch on every wanted directory below top (default: everywhere) that
+        # doesn't have one.  Returns the newly watched directories.
+        added = []
+        stack = [top] if top else list(self._starts)
+        while stack:
+            d = stack.pop()
+            if not self._wanted(d):
+                continue
+            if d not in self._watched:
+                try:
+                    wd = self.inotify.add_watch(d)
+                except OSError:
+                    continue  # gone already, or not a directory
+                self._watched[d] = wd
+                self._wds[wd] = d
+                added.append(d)
+            for name, isdir in listdir(d):
+                if isdir and not os.path.islink(os.path.join(d, name)):
+                    stack.append(os.path.join(d, name))
+        return added
+
+    def _forget(self, wd):
+        d = self._wds.pop(wd, None)
+        if d is not None and self._watched.get(d) == wd:
+            del self._watched[d]
+
+    ####################################################################################
+    # Events
+
+    def poll(self, timeout=None):
+        # Newly dirty targets (and changed Pspecs), once something has changed and the
+        # events have settled; [] if nothing changed within timeout seconds
+        events = self.inotify.read(timeout)
+        if not events:
+            return []
+        first = time.monotonic()
+        while True:
+            left = self.max_delay - (time.monotonic() - first)
+            if left <= 0:
+                break
+            more = self.inotify.read(min(self.debounce, left))
+            if not more:
+                break
+            events.extend(more)
+        return self.apply(events)
+
+    def apply(self, events):
+        # Applies [(wd, mask, name)] events; see poll()
+        changed = {}  # path -> True if it went away; the last event for a path wins
+        created = set()  # paths that didn't exist before these events
+        newdirs = []
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                self.overflows += 1
+                return self.rescan()
+            d = self._wds.get(wd)
+            if d is None:
+                continue
+            if mask & IN_IGNORED:
+                self._forget(wd)
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                continue  # reported as deleted/moved in its parent, if that's watched
+            p = os.path.join(d, name) if name else d
+            gone = bool(mask & (IN_DELETE | IN_MOVED_FROM))
+            if p not in changed and mask & IN_CREATE:
+                created.add(p)  # its first event: there was nothing there before
+            changed[p] = gone
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    newdirs.append(p)
+                elif gone:
+                    changed.update(self._below(p))
+
+        for d in newdirs:
+            # Anything created in it before its watch was added has had no event: look
+            for nd in self.sync_watches(d):
+                for name, isdir in listdir(nd):
+                    p = os.path.join(nd, name)
+                    if p not in changed:
+                        changed[p] = False
+                        created.add(p)
+        return self._changed(changed, created)
+
+    def _below(self, d):
+        # {path: True} for the watched directories under d, and the files nodes know there
+        prefix = d.rstrip(os.sep) + os.sep
+        gone = {}
+        for wd, wdir in list(self._wds.items()):
+            if wdir.startswith(prefix):
+                gone[wdir] = True
+        for root in self.roots:
+            for n in root.topo_order():
+                p = node_path(n)
+                if p is not None and str(canonical(p)).startswith(prefix):
+                    gone[str(canonical(p))] = True
+        return gone
+
+    def _changed(self, changed, created=()):
+        newly = []
+        pspecs = []
+        for root in self.roots:
+            # New inputs first, all looked up before any is added (each add invalidates the trie)
+            new = [(owner, p) for p, gone in changed.items()
+                   if not gone and not root.watchers([p])
+                   for owner in root.leaf_owners([p])]
+            found = []
+            for owner, p in new:
+                if stat_or_none(p) is not None:
+                    found.extend(self._settle(owner.add_leaf(p)))
+            bynode = {}
+            for p, gone in changed.items():
+                for n in root.watchers([p]):
+                    bynode.setdefault(n, []).append((p, gone))
+            index = root.topo_index()
+            for n in sorted(bynode, key=index.__getitem__):
+                found.extend(self._update(n, bynode[n], created))
+            newly.extend(sorted(_unique(found), key=lambda n: index.get(n, len(index))))
+        for ps in self.pspecs:
+            if any(ps in self._pspecs.lookup(p) for p in changed):
+                ps.evaluated = False
+                pspecs.append(ps)
+        return _unique(newly) + pspecs
+
+    def _update(self, n, paths, created=()):
+        # Bring n's mtime up to date with the changes to paths, then its dirty flags
+        newly = []
+        isglob = isinstance(n, GFDepTree) and n.globstr != None
+        if isglob and not n.is_expanded() and all(p.knownDirty for p in n.parents):
+            return newly  # never globbed, and nothing above it can get any dirtier
+        if (isglob and n.is_expanded()
+                and all(p in created and not gone for p, gone in paths)):
+            # only new files under a glob: no old mtime went away, so the oldest and
+            # newest can only have moved out to theirs
+            sts = [stat_or_none(p) for p, gone in paths]
+            mtimes = [st.st_mtime_ns for st in sts if st is not None]
+            if not mtimes:
+                return newly
+            n._min_mtime = min(n._min_mtime, min(mtimes))
+            newly.extend(n.mark_changed(max(mtimes)))
+        elif not n.restat():
+            return newly
+        return newly + self._settle(n)
+
+    def _settle(self, n):
+        # n's mtime has just changed: re-evaluate n against its children, then mark the
+        # ancestors it dirties
+        was = n.knownDirty
+        n.knownDirty = any(c.knownDirty or n.is_older_than(c) for c in n.children)
+        newly = [n] if n.knownDirty and not was else []
+        return newly + n.dirty_ancestors()
+
+    def rescan(self):
+        # After lost events: re-sync the watches and restat every watched node.
+        # Returns what poll() would have.
+        self.sync_watches()
+        newly = []
+        for root in self.roots:
+            index = root.topo_index()
+            found = []
+            for n in root.topo_order():
+                if node_path(n) is not None and n.restat():
+                    found.extend(self._settle(n))
+            newly.extend(sorted(_unique(found), key=lambda n: index.get(n, len(index))))
+        for ps in self.pspecs:
+            ps.evaluated = False
+        return _unique(newly) + list(self.pspecs)
+
+
+def _unique(nodes):
+    seen = set()
+    out = []
+    for n in nodes:
+        if n not in seen:
+            seen.add(n)
+            out.append(n)
+    return out
@@ -0,0 +1,57 @@
+import sys
+import tracemalloc
+from pathlib import Path
+
+from obs_deptree.fdeptree import FDepTree
+
+# Bytes per node: slotted FDepTree with interned paths, versus the old layout
+# (instance __dict__ and a Path per node).
+#
+#   python -m sandbox.bench_nodemem [nodes]
+#
+# The files don't exist, so every node takes the not-yet-generated branch; the
+# stat is the same for both layouts.
+
+VIDS = 200
+
+
+class DictFDepTree:
+    # The pre-slots node layout
+    def __init__(self, children=None, name=None, filepath=None):
+        self.children = children or []
+        self.parents = []
+        self.knownDirty = False
+        self._mtime = 0
+        self.name = name
+        self._cache = None
+        self.filepath = Path(filepath)
+        if self.name == None: self.name = filepath.parts[-1]
+        if self.filepath.exists():
+            self._mtime = self.filepath.stat().st_mtime_ns
+
+
+def filepaths(n):
+    base = Path('/nonexistent/bench')
+    for i in range(n):
+        yield Path(base, 'src', 'VID%04d' % (i % VIDS), 'trip%07d.csv' % i)
+
+
+def bytes_per_node(cls, n):
+    paths = list(filepaths(n))  # not counted
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    nodes = [cls(filepath=p) for p in paths]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(nodes) == n
+    return (after - before) / n
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    old = bytes_per_node(DictFDepTree, n)
+    new = bytes_per_node(FDepTree, n)
+    print('%d nodes over %d directories' % (n, VIDS))
+    print('  __dict__ + Path per node: %6.0f bytes/node' % old)
+    print('  __slots__ + PathTable:    %6.0f bytes/node' % new)
+    print('  saving:                   %5.0f%%' % (100 * (1 - new / old)))
@@ -0,0 +1,60 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import dataproc.papp
+from dataproc.globcache import get_globcache
+from dataproc.parallel import get_io_scheduler, io_concurrency
+from dataproc.processor import Pspec
+
+# Pspec evaluation on a simulated high-latency mount: every os.stat/os.scandir sleeps
+# LATENCY seconds first (as a network round trip would, without holding the GIL).
+#
+#   python -m sandbox.bench_parallel [files] [concurrency ...]
+#
+# A concurrency like 16a is adaptive (iosched.py), with 16 workers.
+
+DIRS = 20
+SPEC = 'src/*/*.csv'
+LATENCY = 0.001
+
+
+def make_tree(base, n):
+    for d in range(DIRS):
+        Path(base, 'src', 'VID%03d' % d).mkdir(parents=True)
+    for i in range(n):
+        Path(base, 'src', 'VID%03d' % (i % DIRS), 'f%06d.csv' % i).touch()
+
+
+def slow(real):
+    def wrapper(*a, **kw):
+        time.sleep(LATENCY)
+        return real(*a, **kw)
+    return wrapper
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    levels = sys.argv[2:] or ['1', '4', '16', '16a']
+    base = tempfile.mkdtemp()
+    saved = os.stat, os.scandir
+    try:
+        make_tree(base, n)
+        papp = dataproc.papp.Papp(basedir=base)
+        os.stat, os.scandir = slow(saved[0]), slow(saved[1])
+        for c in levels:
+            get_globcache().clear()
+            with io_concurrency(int(c.rstrip('a')), adaptive=c.endswith('a')):
+                t = time.perf_counter()
+                p = Pspec(SPEC, papp=papp)
+                secs = time.perf_counter() - t
+                sched = get_io_scheduler()
+                limits = ('  limits %s' % sched.limits()) if sched else ''
+            assert p.filecount == n
+            print('concurrency %4s  %7.3fs%s' % (c, secs, limits))
+    finally:
+        os.stat, os.scandir = saved
+        shutil.rmtree(base)
@@ -0,0 +1,90 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from dataproc.scan import scan_pathglob
+
+# Pspec-style enumeration of src/*/*.csv: the old Path.glob + exists() + stat() loop
+# versus scan_pathglob (os.scandir, one stat per file).
+#
+#   python -m sandbox.bench_scan [files]
+#
+# Syscalls are counted by wrapping os.stat/os.lstat/os.scandir, in a separate run
+# from the timing.
+
+DIRS = 100
+SPEC = 'src/*/*.csv'
+
+
+def make_tree(base, n):
+    for d in range(DIRS):
+        Path(base, 'src', 'VID%03d' % d).mkdir(parents=True)
+    for i in range(n):
+        Path(base, 'src', 'VID%03d' % (i % DIRS), 'f%07d.csv' % i).touch()
+
+
+def old_way(base):
+    # What Pspec.evaluate_spec used to do
+    expanded = [Path(base)]
+    for part in Path(SPEC).parts:
+        expanded = [g for p in expanded for g in p.glob(part)]
+    count, lo, hi = 0, float('inf'), 0
+    for f in expanded:
+        if not f.exists(): continue
+        count += 1
+        mt = f.stat().st_mtime_ns
+        lo, hi = min(lo, mt), max(hi, mt)
+    return count, lo, hi
+
+
+def new_way(base):
+    count, lo, hi = 0, float('inf'), 0
+    for f, st in scan_pathglob(SPEC, base):
+        count += 1
+        mt = st.st_mtime_ns
+        lo, hi = min(lo, mt), max(hi, mt)
+    return count, lo, hi
+
+
+def count_syscalls(func, *args):
+    counts = {'stat': 0, 'lstat': 0, 'scandir': 0}
+    saved = os.stat, os.lstat, os.scandir
+
+    def counting(name, real):
+        def wrapper(*a, **kw):
+            counts[name] += 1
+            return real(*a, **kw)
+        return wrapper
+
+    os.stat = counting('stat', saved[0])
+    os.lstat = counting('lstat', saved[1])
+    os.scandir = counting('scandir', saved[2])
+    try:
+        result = func(*args)
+    finally:
+        os.stat, os.lstat, os.scandir = saved
+    return result, counts
+
+
+def timed(func, *args):
+    t = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    base = tempfile.mkdtemp()
+    try:
+        make_tree(base, n)
+        for label, func in [('Path.glob + exists + stat', old_way), ('scan_pathglob', new_way)]:
+            result, counts = count_syscalls(func, base)
+            result2, secs = timed(func, base)
+            assert result == result2 and result[0] == n
+            print('%-26s %7.3fs  stat=%d lstat=%d scandir=%d'
+                  % (label, secs, counts['stat'], counts['lstat'], counts['scandir']))
+    finally:
+        shutil.rmtree(base)
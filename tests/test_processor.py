@@ -105,3 +105,278 @@ def test_pspec_deep(deepdir):
     a.evaluate_spec()
     assert f.is_dirtied_by(a)
 
+
+###########################################
+# Scanning tests
+###########################################
+def test_expand_pathglobs(deepdir):
+    l = dataproc.processor.expand_pathglobs('s*/a*', deepdir)
+    assert sorted(p.name for p in l) == ['a11', 'a12', 'a21', 'a22']
+    l = dataproc.processor.expand_pathglobs(Path(deepdir, 'db/*'))
+    assert len(l) == 4
+    assert dataproc.processor.expand_pathglobs('nothere/*', deepdir) == []
+    assert dataproc.processor.expand_pathglobs('db/final/*', deepdir) == []
+
+def test_scan_pathglob(deepdir):
+    from dataproc.scan import scan_pathglob
+    l = scan_pathglob('*/a1*', deepdir)
+    assert sorted(Path(p).name for p, st in l) == ['a1', 'a11', 'a12']
+    assert all(st.st_mtime_ns > 0 for p, st in l)
+    assert scan_pathglob('db/int', deepdir)[0][0] == str(Path(deepdir, 'db/int'))
+    assert scan_pathglob('db/nothere', deepdir) == []
+
+def test_pspec_minmax(deepdir):
+    papp = dataproc.papp.Papp(basedir=deepdir)
+    time.sleep(0.005) # required to guarantee an mtime_ns difference
+    Path(deepdir, 'db/a2').touch()
+    f = dataproc.processor.Pspec([Path('db/a1'), Path('db/a2')], papp=papp)
+    assert f.filecount == 2
+    assert f._smallest_mtime == Path(deepdir, 'db/a1').stat().st_mtime_ns
+    assert f._biggest_mtime == Path(deepdir, 'db/a2').stat().st_mtime_ns
+
+def test_globcache(deepdir):
+    from dataproc.globcache import GlobCache
+    from dataproc.scan import scan_pathglob
+    cache = GlobCache(maxsize=2, racy_ns=0)
+    src = str(Path(deepdir, 'src'))
+    assert len(scan_pathglob('src/a*', deepdir, cache=cache)) == 4
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert len(scan_pathglob('src/a*', deepdir, cache=cache)) == 4
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # a new entry moves the directory's mtime
+    time.sleep(0.005) # required to guarantee an mtime_ns difference
+    Path(src, 'a13').touch()
+    assert len(scan_pathglob('src/a*', deepdir, cache=cache)) == 5
+    assert cache.misses == 2
+
+    # LRU bound
+    cache.match(src, 'b*')
+    cache.match(src, 'c*')
+    assert len(cache) == 2
+    assert (src, 'a*') not in cache._entries
+
+def test_globcache_racy(deepdir):
+    from dataproc.globcache import GlobCache
+    cache = GlobCache()
+    Path(deepdir, 'src', 'new').touch()
+    cache.match(str(Path(deepdir, 'src')), '*')
+    assert len(cache) == 0  # modified just now: not trusted
+
+def test_snapshot(deepdir):
+    from dataproc.snapshot import open_snapshot, snapshot_for
+    from obs_deptree.gfdeptree import GFDepTree
+    papp = dataproc.papp.Papp(basedir=deepdir)
+    with open_snapshot(deepdir) as snap:
+        assert snapshot_for(Path(deepdir, 'src', 'x')) is snap
+        a = dataproc.processor.Pspec('src/a*', papp=papp)
+        b = dataproc.processor.Pspec('src/a1*', papp=papp)
+        g = GFDepTree(filepath=Path(deepdir, 'src'), globstr='a2*')
+        assert (a.filecount, b.filecount) == (4, 2)
+        assert g._max_mtime > 0
+        assert snap.listed == 1      # src/ listed once for all three
+        assert snap.stated == 4      # each file stat'ed once
+
+        # a missing output: known from the listing, no stat
+        missing = GFDepTree(filepath=Path(deepdir, 'src', 'out.pickle'))
+        assert missing._mtime == 0
+        assert snap.stated == 4
+        # elsewhere: stat'ed once, then remembered
+        for i in range(3):
+            assert GFDepTree(filepath=Path(deepdir, 'db', 'out.pickle'))._mtime == 0
+        assert snap.stated == 5
+    assert snapshot_for(deepdir) is None
+
+def test_snapshot_nested(deepdir):
+    from dataproc.snapshot import open_snapshot, snapshot_for
+    with open_snapshot(deepdir) as outer:
+        with open_snapshot(deepdir) as inner:
+            assert inner is outer
+        assert snapshot_for(deepdir) is outer  # the inner with doesn't close the outer
+    assert snapshot_for(deepdir) is None
+
+def test_snapshot_threads(deepdir):
+    # Open snapshots are per thread, but the I/O pool works with its caller's
+    from concurrent.futures import ThreadPoolExecutor
+    from dataproc.parallel import io_concurrency, io_map, io_submit
+    from dataproc.snapshot import open_snapshot, snapshot_for
+    paths = [Path(deepdir, 'src', n) for n in ['a1', 'a2', 'x']]
+    with open_snapshot(deepdir) as snap:
+        with ThreadPoolExecutor(max_workers=1) as other:
+            assert other.submit(snapshot_for, deepdir).result() is None
+        with io_concurrency(4):
+            assert io_map(snapshot_for, paths) == [snap] * 3
+            assert io_submit(snapshot_for, paths[0]).result() is snap
+        with io_concurrency(4, adaptive=True):
+            assert io_map(snapshot_for, paths) == [snap] * 3
+    with io_concurrency(4):
+        assert io_map(snapshot_for, paths) == [None] * 3
+
+def test_pathglob_matcher(deepdir):
+    from dataproc.globcache import GlobCache
+    from dataproc.matcher import compile_pathglobs
+    from dataproc.scan import scan_pathglob
+    Path(deepdir, 'src', 'b1').mkdir()
+    Path(deepdir, 'src', 'b1', 'b11').touch()
+    specs = ['src/a1*', 'src/a*', '*/a2*', 'src/*/b*', Path('db/final'), Path('db/nothere'), Path('src/b1')]
+    m = compile_pathglobs(specs)
+    cache = GlobCache(racy_ns=0)
+    found = m.match(deepdir, cache=cache)
+    names = {spec: sorted(Path(p).name for p, st in found[spec].files) for spec in specs}
+    assert names == {'src/a1*': ['a11', 'a12'], 'src/a*': ['a11', 'a12', 'a21', 'a22'],
+                     '*/a2*': ['a2', 'a21', 'a22'], 'src/*/b*': ['b11'],
+                     Path('db/final'): ['final'], Path('db/nothere'): [], Path('src/b1'): []}
+    assert cache.misses == 4  # ., db, src and src/b1: each listed once
+    a = found['src/a*']
+    assert a.filecount == 4
+    assert a.min_mtime == min(st.st_mtime_ns for p, st in a.files)
+    assert a.max_mtime == max(st.st_mtime_ns for p, st in a.files)
+    # the same specs one at a time
+    for spec in specs:
+        if isinstance(spec, str):
+            assert names[spec] == sorted(Path(p).name for p, st in scan_pathglob(spec, deepdir))
+
+def test_evaluate_pspecs(deepdir):
+    papp = dataproc.papp.Papp(basedir=deepdir)
+    pspecs = [dataproc.processor.Pspec(s, papp=papp, evaluate=False) for s in ['src/a1*', 'src/a2*', 'db/*']]
+    dataproc.processor.evaluate_pspecs(pspecs)
+    assert [ps.filecount for ps in pspecs] == [2, 2, 4]
+    single = dataproc.processor.Pspec('src/a2*', papp=papp)
+    assert (single._smallest_mtime, single._biggest_mtime) == (pspecs[1]._smallest_mtime, pspecs[1]._biggest_mtime)
+
+def test_recursive_pathglobs(deepdir):
+    import os
+    from dataproc.globcache import GlobCache
+    from dataproc.matcher import compile_pathglobs
+    from dataproc.scan import iter_pathglob, scan_pathglob
+    for d in ['src/c/d', 'src/c/e', 'src/c/c']:
+        Path(deepdir, d).mkdir(parents=True)
+        Path(deepdir, d, 'x.csv').touch()
+    os.symlink(Path(deepdir, 'src'), Path(deepdir, 'src/c/loop'))
+    specs = ['**/x.csv', 'src/**', 'src/**/a1*', '**/**/*.csv', '**/c/*/x.csv',
+             'src/**/c/**/x.csv']  # src/c/c/x.csv is reached through either '**'
+    found = compile_pathglobs(specs).match(deepdir)
+    for spec in specs:
+        want = sorted(set(str(p) for p in Path(deepdir).glob(spec)))
+        assert sorted(p for p, st in scan_pathglob(spec, deepdir)) == want
+        assert sorted(p for p, st in found[spec].files) == want
+
+    # streamed: the first match comes out before the rest of the tree is listed
+    cache = GlobCache(racy_ns=0)
+    matches = iter_pathglob('**/*', deepdir, cache=cache)
+    next(matches)
+    assert cache.misses == 1
+    assert len(list(matches)) > 10
+
+def test_iter_pathglobs(deepdir):
+    it = dataproc.processor.iter_pathglobs('s*/**/a1*', deepdir)
+    assert next(it).name in ('a11', 'a12')
+    assert sorted(p.name for p in dataproc.processor.expand_pathglobs('**/a1*', deepdir)) == ['a1', 'a11', 'a12']
+    papp = dataproc.papp.Papp(basedir=deepdir)
+    assert dataproc.processor.Pspec('**/a*', papp=papp).filecount == 6
+
+def test_parallel_io(deepdir):
+    from dataproc.matcher import compile_pathglobs
+    from dataproc.parallel import io_concurrency, get_io_concurrency
+    papp = dataproc.papp.Papp(basedir=deepdir)
+    specs = ['src/a1*', '**/a*', 'db/*', Path('db/final')]
+    serial = compile_pathglobs(specs).match(deepdir)
+    with io_concurrency(4):
+        assert get_io_concurrency() == 4
+        found = compile_pathglobs(specs).match(deepdir)
+        a = dataproc.processor.Pspec('**/a*', papp=papp)
+    assert get_io_concurrency() == 1
+    for spec in specs:
+        assert found[spec].files == serial[spec].files
+    assert (a.filecount, a._smallest_mtime) == (serial['**/a*'].filecount, serial['**/a*'].min_mtime)
+
+def test_device_limiter():
+    from dataproc.iosched import DeviceLimiter
+    lim = DeviceLimiter(0, max_limit=8, start=2)
+    for i in range(40):  # steady latency: additive increase, up to max_limit
+        lim.acquire()
+        lim.release(0.001)
+    assert int(lim.limit) == 8
+    for i in range(8):  # latency blows up: multiplicative decrease
+        lim.acquire()
+        lim.release(0.1)
+    low = int(lim.limit)
+    assert low < 8
+    for i in range(60):  # and recovers
+        lim.acquire()
+        lim.release(0.001)
+    assert int(lim.limit) > low
+    assert lim.stats()['completed'] == 108 and lim.inflight == 0
+    lim = DeviceLimiter(0, max_limit=8, start=2)
+    for secs in [1e-6, 1e-5] * 20:  # under the floor: never congestion
+        lim.acquire()
+        lim.release(secs)
+    assert int(lim.limit) == 8
+
+def test_device_limiter_fast_phase():
+    # A fast phase (cache hits) first mustn't make the steady latency look like congestion
+    from dataproc.iosched import DeviceLimiter
+    lim = DeviceLimiter(0, max_limit=16)
+    for i in range(50):
+        lim.acquire()
+        lim.release(20e-6)
+    for i in range(2000):
+        lim.acquire()
+        lim.release(0.001)
+    assert int(lim.limit) == 16
+
+def test_io_scheduler_queues():
+    # A throttled device's backlog doesn't hold up the workers another device could use
+    from concurrent.futures import ThreadPoolExecutor
+    from dataproc.iosched import IOScheduler
+    sched = IOScheduler(max_limit=8)
+    sched.device_of = lambda path: path[0]  # 's'low and 'f'ast devices
+    slow = sched.limiter('s')
+    slow.limit = slow.max_limit = 1
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        start = time.perf_counter()
+        slows = [sched.submit(pool, 's%d' % i, time.sleep, 0.05) for i in range(8)]
+        fasts = [sched.submit(pool, 'f%d' % i, lambda i: i, i) for i in range(64)]
+        assert [f.result() for f in fasts] == list(range(64))
+        assert time.perf_counter() - start < 0.2  # the slow ones take 0.4s in all
+        assert not slows[-1].done()
+        [f.result() for f in slows]
+    assert sched.stats()['s']['completed'] == 8 and sched.stats()['s']['inflight'] == 0
+    assert sched.stats()['f']['queued'] == 0
+
+def test_adaptive_io(deepdir):
+    import os
+    from dataproc.matcher import compile_pathglobs
+    from dataproc.parallel import io_concurrency, get_io_scheduler, io_run
+    serial = compile_pathglobs(['**/*']).match(deepdir)['**/*'].files
+    with io_concurrency(4, adaptive=True):
+        sched = get_io_scheduler()
+        assert compile_pathglobs(['**/*']).match(deepdir)['**/*'].files == serial
+        assert io_run(Path(deepdir, 'db', 'final'), os.path.getsize, Path(deepdir, 'db', 'final')) == 0
+        dev = os.stat(deepdir).st_dev
+        assert list(sched.limits()) == [dev]
+        assert 1 <= sched.limits()[dev] <= 4
+        assert sched.stats()[dev]['completed'] > 10
+    assert get_io_scheduler() is None
+
+def test_pspec_early_exit(deepdir, monkeypatch):
+    import os
+    papp = dataproc.papp.Papp(basedir=deepdir)
+    out = dataproc.processor.Pspec('db/*', papp=papp)
+    time.sleep(0.005) # required to guarantee an mtime_ns difference
+    Path(deepdir, 'src', 'many').mkdir()
+    for i in range(50):
+        Path(deepdir, 'src', 'many', 'f%02d' % i).touch()
+
+    stats = []
+    real = os.stat
+    monkeypatch.setattr(os, 'stat', lambda p, *a, **kw: stats.append(p) or real(p, *a, **kw))
+    inputs = dataproc.processor.Pspec('src/many/*', papp=papp, evaluate=False)
+    assert out.is_partly_older_than(inputs)
+    assert len([p for p in stats if 'many' in str(p)]) < 5  # stopped at the first newer file
+    assert not inputs.evaluated
+
+    # clean: the whole scan, which leaves the inputs evaluated
+    old = dataproc.processor.Pspec('src/a*', papp=papp, evaluate=False)
+    assert not out.is_partly_older_than(old)
+    assert old.evaluated and old.filecount == 4